@@ -0,0 +1,75 @@
+'''
+Compare jwpy.misc.align_frames() against chaining the previous two-frame
+align_cols() over many frames with partly overlapping columns, as when
+stacking years of HCUP files whose layouts drift.
+
+Usage:
+    python benchmarks/bench_align_frames.py [n_frames] [n_cols] [n_rows]
+'''
+from __future__ import print_function
+import sys
+from operator import xor
+import numpy as np
+import pandas as pd
+from jwpy.misc import Timer, align_frames
+
+
+def align_cols_sets(df1, df2):
+    # the previous implementation, kept here for comparison
+    p1, p2 = df1.align(df2, axis=1)
+    levels = {col: set() for col in p1.columns}
+    for col in levels.keys():
+        check = (str(p1[col].dtype) == 'category',
+                 str(p2[col].dtype) == 'category')
+        if check[0] | check[1]:
+            if xor(check[0], check[1]):
+                if check.index(True):
+                    p1[col] = p1[col].astype('category')
+                else:
+                    p2[col] = p2[col].astype('category')
+            for d in (p1, p2):
+                levels[col] = set.union(levels[col], d[col].cat.categories)
+            for d in (p1, p2):
+                _newlevels = list(levels[col] - set(d[col].cat.categories))
+                d[col] = d[col].cat.add_categories(_newlevels)
+                d[col] = d[col].cat.reorder_categories(levels[col])
+    return p1, p2
+
+
+def make_frames(n_frames, n_cols, n_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(n_frames):
+        # each frame drops a random tenth of the columns
+        keep = np.sort(rng.choice(n_cols, int(n_cols * .9), replace=False))
+        data = {}
+        for j in keep:
+            if j % 3 == 0:
+                levels = ['L{}_{}'.format(j, x) for x in range(20 + i)]
+                data['C{}'.format(j)] = pd.Categorical(
+                    rng.choice(levels, n_rows))
+            else:
+                data['C{}'.format(j)] = rng.randint(0, 100, n_rows) / 4.
+        frames.append(pd.DataFrame(data))
+    return frames
+
+
+if __name__ == '__main__':
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    n_rows = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    frames = make_frames(n_frames, n_cols, n_rows)
+    print('{} frames of up to {} columns, {} rows:'.format(
+        n_frames, n_cols, n_rows))
+    print('  {:<14}'.format('chained pairs'), end='')
+    with Timer():
+        # every new frame is aligned against the growing stack
+        old = frames[0]
+        for df in frames[1:]:
+            old, df = align_cols_sets(old, df)
+            old = pd.concat([old, df], ignore_index=True)
+    print('  {:<14}'.format('align_frames'), end='')
+    with Timer():
+        new = pd.concat(align_frames(*frames), ignore_index=True)
+    print('  same values:', (old[new.columns].astype(object).fillna('')
+                             == new.astype(object).fillna('')).all().all())
@@ -0,0 +1,64 @@
+'''
+Time the computations aov_xtab() does before plotting, on a simulated
+binary outcome by two grouping factors: the previous separate groupby sums
+and counts, crosstab and pivot_table against one CrossTabStats pass. The
+beta-binomial fit is the same for both and isn't timed. The CrossTabStats
+pass is timed again with the grouping factors as categoricals of string
+labels.
+
+Usage:
+    python benchmarks/bench_aov_xtab.py [n_rows] [n_index] [n_columns]
+'''
+from __future__ import print_function
+import sys
+from functools import partial
+import numpy as np
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.explore_funcs import CrossTabStats, shrink
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    n_index = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    n_columns = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+    rng = np.random.RandomState(0)
+    dat = pd.DataFrame({
+        'values': rng.binomial(1, 0.02, n_rows),
+        'index': rng.randint(n_index, size=n_rows),
+        'columns': rng.randint(n_columns, size=n_rows)})
+    a, b = 1., 50.
+    print('{} rows, {} x {} cells:'.format(n_rows, n_index, n_columns))
+
+    print('  {:<14}'.format('groupby'), end='')
+    with Timer():
+        endog = pd.DataFrame({
+            'k': dat.groupby(['index', 'columns'])['values'].sum(),
+            'n': dat.groupby(['index', 'columns'])['values'].count()})
+        shrunk = pd.pivot_table(dat, values='values', index='index',
+                                columns='columns',
+                                aggfunc=partial(shrink, a=a, b=b),
+                                fill_value=a / (a + b))
+        annot = pd.crosstab(dat['index'], dat['columns'])
+
+    print('  {:<14}'.format('CrossTabStats'), end='')
+    with Timer():
+        stats = CrossTabStats(dat['values'], dat['index'], dat['columns'])
+        stats.a, stats.b = a, b
+        result = stats.endog, stats.shrunk, stats.counts
+
+    # zero-padded labels sort in the same order as the integer keys
+    index, columns = [
+        pd.Categorical.from_codes(
+            dat[name], ['{}{:04d}'.format(name, i) for i in range(size)])
+        for name, size in [('index', n_index), ('columns', n_columns)]]
+    print('  {:<14}'.format('categorical'), end='')
+    with Timer():
+        cats = CrossTabStats(dat['values'], index, columns)
+        cats.a, cats.b = a, b
+        cat_result = cats.endog, cats.shrunk, cats.counts
+
+    np.testing.assert_allclose(result[1].values, shrunk.values)
+    np.testing.assert_array_equal(result[2].values, annot.values)
+    np.testing.assert_allclose(cat_result[1].values, shrunk.values)
+    np.testing.assert_array_equal(cat_result[2].values, annot.values)
@@ -0,0 +1,89 @@
+'''
+Time jwpy.betabinom.betabinom on simulated groups: one negative
+log-likelihood evaluation against the previous log-factorial implementation,
+then fit() with the analytic score/hessian against statsmodels' numerical
+derivatives, counting log-likelihood evaluations; and the log-likelihood of
+a sparse cross-tab with many small cells, evaluated per row vs per unique
+(k, n) pair.
+
+Usage:
+    python benchmarks/bench_betabinom.py [n_groups] [max_n]
+'''
+from __future__ import print_function
+import sys
+import numpy as np
+import pandas as pd
+import scipy as sp
+from jwpy.misc import Timer
+from statsmodels.base.model import GenericLikelihoodModel
+from jwpy.betabinom import betabinom
+
+
+def simulate(n_groups, max_n, a=2., b=5., seed=0):
+    rng = np.random.RandomState(seed)
+    n = rng.randint(1, max_n, size=n_groups)
+    k = rng.binomial(n, rng.beta(a, b, size=n_groups))
+    return pd.DataFrame({'k': k, 'n': n})
+
+
+def pmf_log_factorials(endog, a, b):
+    # the previous implementation, kept here for comparison
+    k, n = endog.T
+    return np.array([np.log(np.arange(i, 1, -1)).sum() for i in n]) \
+        - np.array([np.log(np.arange(i, 1, -1)).sum() for i in k]) \
+        - np.array([np.log(np.arange(i, 1, -1)).sum() for i in n-k]) \
+        + sp.special.betaln(k+a, n-k+b) \
+        - sp.special.betaln(a, b)
+
+
+class numeric_betabinom(betabinom):
+    '''betabinom with statsmodels' finite-difference derivatives.'''
+    score = GenericLikelihoodModel.score
+    score_obs = GenericLikelihoodModel.score_obs
+    hessian = GenericLikelihoodModel.hessian
+
+
+def time_fit(model, method):
+    calls = [0]
+    loglike = model.loglike
+
+    def counted(params):
+        calls[0] += 1
+        return loglike(params)
+    model.loglike = counted
+    with Timer(verbose=False) as t:
+        res = model.fit(method=method, disp=0)
+    return res, t.interval, calls[0]
+
+
+if __name__ == '__main__':
+    sparse = simulate(2000000, 8, a=0.2, b=8.)
+    model = betabinom(endog=sparse)
+    print('{} sparse cells, {} unique (k, n) pairs:'.format(
+        len(sparse), len(model._freq)))
+    print('  {:<14}'.format('per row'), end='')
+    with Timer():
+        old = model.pmf_log(sparse, 0.2, 8.).sum()
+    print('  {:<14}'.format('per pair'), end='')
+    with Timer():
+        new = model.loglike([0.2, 8.])
+    np.testing.assert_allclose(new, old)
+
+    n_groups = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    max_n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    endog = simulate(n_groups, max_n)
+    print('{} groups, n up to {}:'.format(n_groups, max_n))
+    model = betabinom(endog=endog)
+    print('  {:<14}'.format('log-factorial'), end='')
+    with Timer():
+        old = -pmf_log_factorials(model.endog, 2., 5.).sum()
+    print('  {:<14}'.format('gammaln'), end='')
+    with Timer():
+        new = model.nloglikeobs(np.array([2., 5.])).sum()
+    np.testing.assert_allclose(new, old)
+    for method in ['nm', 'bfgs', 'lbfgs']:
+        for cls in [numeric_betabinom, betabinom]:
+            res, secs, calls = time_fit(cls(endog=endog), method)
+            print('  fit {:<5} {:<18} {:.3f} seconds, {:>4} evaluations, '
+                  'a={:.4f} b={:.4f}'.format(method, cls.__name__, secs,
+                                             calls, *res.params))
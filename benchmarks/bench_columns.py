@@ -0,0 +1,53 @@
+'''
+Wall time and peak RSS of reading a handful of columns versus the full column
+set of a synthetic NIS DX_PR_GRPS file with jwpy.sas_fwf.read_hcup(). Each
+case runs in a fresh subprocess so that peak RSS is measured independently.
+
+Usage:
+    python benchmarks/bench_columns.py [n_records]
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import resource
+import tempfile
+import subprocess
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup
+from bench_read_hcup import fixtures, make_file
+
+name = 'NIS_2015Q1Q3_DX_PR_GRPS'
+cases = {'all columns': None,
+         'DX1 + PRn + KEY_NIS': ['DX1', 'PRn', 'KEY_NIS']}
+
+
+def run_case(data_file, engine, columns):
+    sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+    with Timer(verbose=False) as t:
+        read_hcup(data_file, sas_script, engine=engine, columns=columns)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(json.dumps({'seconds': t.interval, 'peak_mb': peak}))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--case']:
+        run_case(sys.argv[2], sys.argv[3], json.loads(sys.argv[4]))
+        sys.exit()
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    tmp = tempfile.mkdtemp()
+    try:
+        data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                              n_records)
+        print('{} ({} records):'.format(name, n_records))
+        for engine in ['pandas', 'numpy']:
+            for label, columns in cases.items():
+                out = subprocess.check_output(
+                    [sys.executable, __file__, '--case', data_file, engine,
+                     json.dumps(columns)])
+                res = json.loads(out.decode().strip().splitlines()[-1])
+                print('  engine={:<7} {:<20} {:8.2f} s {:9.1f} MB peak RSS'
+                      .format(engine, label, res['seconds'], res['peak_mb']))
+    finally:
+        shutil.rmtree(tmp)
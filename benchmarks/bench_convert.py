@@ -0,0 +1,48 @@
+'''
+Time re-parsing a synthetic NIS Core file with jwpy.sas_fwf.read_hcup()
+against loading the same data after a one-time jwpy.sas_fwf.convert(), with
+and without a filter on the partition column.
+
+Usage:
+    python benchmarks/bench_convert.py [n_records]
+'''
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup, convert, read_converted
+from bench_read_hcup import fixtures, make_file
+
+name = 'NIS_2015_Core'
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmp = tempfile.mkdtemp()
+    try:
+        data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                              n_records)
+        sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+        print('{} ({} records):'.format(name, n_records))
+        for engine in ['pandas', 'numpy']:
+            print('  read_hcup(engine={!r}):'.format(engine).ljust(40), end='')
+            with Timer():
+                read_hcup(data_file, sas_script, engine=engine,
+                          compact_dtypes=True)
+        for format in ['parquet', 'feather']:
+            output = os.path.join(tmp, format)
+            print('  convert(format={!r}):'.format(format).ljust(40), end='')
+            with Timer():
+                convert(data_file, sas_script, output, format=format,
+                        partition_cols=['DQTR'], engine='numpy',
+                        compact_dtypes=True)
+            print('  read_converted():'.ljust(40), end='')
+            with Timer():
+                read_converted(output, format=format)
+            print('  read_converted(DQTR == 1):'.ljust(40), end='')
+            with Timer():
+                read_converted(output, format=format,
+                               filters=[('DQTR', '==', 1)])
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,35 @@
+'''
+Throughput of jwpy.betabinom.fit_many() against fitting each model with
+betabinom(...).fit(), on many small simulated problems.
+
+Usage:
+    python benchmarks/bench_fit_many.py [n_models] [n_groups] [n_jobs]
+'''
+from __future__ import print_function
+import sys
+import warnings
+import numpy as np
+from jwpy.misc import Timer
+from jwpy.betabinom import betabinom, fit_many
+from bench_betabinom import simulate
+
+
+if __name__ == '__main__':
+    n_models = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_groups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    n_jobs = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    endogs = [simulate(n_groups, 50, a=1 + i % 5, b=10, seed=i)
+              for i in range(n_models)]
+    print('{} models of {} groups:'.format(n_models, n_groups))
+    # a sample of one-at-a-time fits is enough to get the rate
+    n_loop = min(n_models, 200)
+    with Timer(verbose=False) as t, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        loop = [betabinom(endog=x).fit(disp=0).params for x in endogs[:n_loop]]
+    print('  {:<10} {:8.0f} fits/second'.format('fit()', n_loop / t.interval))
+    with Timer(verbose=False) as t:
+        result = fit_many(endogs, n_jobs=n_jobs)
+    print('  {:<10} {:8.0f} fits/second, {} iterations at most'.format(
+        'fit_many()', n_models / t.interval, result['iterations'].max()))
+    np.testing.assert_allclose(result[['a', 'b']].values[:n_loop], loop,
+                               rtol=1e-2)
@@ -0,0 +1,61 @@
+'''
+Attach the NIS Hospital file to a streamed synthetic Core file: reading the
+Hospital file every time and merging it onto each chunk, versus
+read_hcup(..., join={'HOSP_NIS': ...}), which parses it once, caches it,
+and maps each chunk's HOSP_NIS categories to table rows.
+
+Usage:
+    python benchmarks/bench_join_hospital.py [n_records] [chunksize] [runs]
+'''
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup
+from bench_read_hcup import fixtures, make_file
+
+
+def hcup_paths(name, data_dir=fixtures):
+    return (os.path.join(data_dir, name + '.fwf'),
+            os.path.join(fixtures, 'SASLoad_' + name + '.SAS'))
+
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    tmp = tempfile.mkdtemp()
+    try:
+        make_file(os.path.join(tmp, 'NIS_2015_Core.fwf'), 'NIS_2015_Core',
+                  n_records)
+        core = hcup_paths('NIS_2015_Core', tmp)
+        hosp = hcup_paths('NIS_2015_Hospital')
+        print('Core ({} records, chunksize {}) + Hospital, {} runs:'.format(
+            n_records, chunksize, runs))
+        print('  {:<16}'.format('merge per chunk'), end='')
+        with Timer():
+            for _ in range(runs):
+                table = read_hcup(*hosp, engine='numpy')
+                # the columns Core already has, as join= leaves them out
+                table = table.drop(columns=['DISCWT', 'HOSP_DIVISION',
+                                            'NIS_STRATUM', 'YEAR'])
+                for chunk in read_hcup(*core, chunksize=chunksize,
+                                       combine_chunks=False, engine='numpy'):
+                    chunk.merge(table, on='HOSP_NIS', how='left')
+        print('  {:<16}'.format('join='), end='')
+        with Timer():
+            for _ in range(runs):
+                for chunk in read_hcup(*core, chunksize=chunksize,
+                                       combine_chunks=False, engine='numpy',
+                                       join={'HOSP_NIS': hosp}):
+                    pass
+        print('  {:<16}'.format('no join'), end='')
+        with Timer():
+            for _ in range(runs):
+                for chunk in read_hcup(*core, chunksize=chunksize,
+                                       combine_chunks=False, engine='numpy'):
+                    pass
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,71 @@
+'''
+Joined extract of a patient subset from synthetic NIS Core and Severity
+files: reading both in full with read_hcup() and merging on KEY_NIS, versus
+join_hcup() on their sidecar KEY_NIS indexes (timed both when the indexes
+have to be built and when they are reused).
+
+Usage:
+    python benchmarks/bench_key_join.py [n_records] [n_keys]
+'''
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup, join_hcup, get_layout
+from bench_read_hcup import fixtures, make_file
+
+names = ['NIS_2015_Core', 'NIS_2015Q1Q3_Severity']
+
+
+def unique_keys(data_file, sas_script):
+    # the repeated fixture records share their keys, so renumber them
+    layout = get_layout(sas_script)
+    i = layout.names.index('KEY_NIS')
+    start, width = layout.starts[i] - 1, layout.widths[i]
+    with open(data_file, 'rb') as f:
+        reclen = len(f.readline())
+    records = np.memmap(data_file, dtype=np.uint8, mode='r+')
+    records = records.reshape(-1, reclen)
+    keys = np.char.zfill((10000000 + np.arange(len(records))).astype(
+        'U{}'.format(width)), width)
+    records[:, start:start+width] = np.frombuffer(
+        keys.astype('S{}'.format(width)).tobytes(),
+        dtype=np.uint8).reshape(-1, width)
+    records.flush()
+
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    n_keys = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    tmp = tempfile.mkdtemp()
+    try:
+        specs = []
+        for name in names:
+            sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+            data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                                  n_records)
+            unique_keys(data_file, sas_script)
+            specs.append((data_file, sas_script))
+        keys = np.random.RandomState(0).choice(n_records, n_keys,
+                                               replace=False) + 10000000.
+        print('Core + Severity ({} records each), {} keys:'.format(
+            n_records, n_keys))
+        print('  {:<22}'.format('read_hcup + merge'), end='')
+        with Timer():
+            core, sev = [read_hcup(*x, engine='numpy') for x in specs]
+            core['KEY_NIS'] = core['KEY_NIS'].astype(float)
+            core = core[core['KEY_NIS'].isin(keys)]
+            sev = sev[[x for x in sev.columns
+                       if x not in core.columns or x == 'KEY_NIS']]
+            old = core.merge(sev, on='KEY_NIS')
+        for label in ['join_hcup (build)', 'join_hcup (reuse)']:
+            print('  {:<22}'.format(label), end='')
+            with Timer():
+                new = pd.concat(join_hcup(specs, keys=keys))
+        assert len(old) == len(new) == n_keys
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,49 @@
+'''
+Compare the pandas and numpy engines of jwpy.sas_fwf.read_hcup() on a
+synthetic NIS Core file built by repeating the records of the test fixture.
+
+Usage:
+    python benchmarks/bench_read_hcup.py [n_records]
+'''
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup
+
+fixtures = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fwf_test')
+
+
+def make_file(path, name, n_records):
+    with open(os.path.join(fixtures, name + '.fwf'), 'rb') as f:
+        records = f.read()
+    n_fixture = records.count(b'\n')
+    with open(path, 'wb') as f:
+        for _ in range(n_records // n_fixture):
+            f.write(records)
+    return path
+
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    tmp = tempfile.mkdtemp()
+    try:
+        for name in ['NIS_2015_Core', 'NIS_2015Q4_DX_PR_GRPS']:
+            data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                                  n_records)
+            sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+            print('{} ({} records):'.format(name, n_records))
+            results = {}
+            for engine in ['pandas', 'numpy']:
+                print('  engine={:<8}'.format(engine), end='')
+                with Timer():
+                    results[engine] = read_hcup(data_file, sas_script,
+                                                engine=engine)
+            pd.testing.assert_frame_equal(results['pandas'],
+                                          results['numpy'],
+                                          check_categorical=False)
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,64 @@
+'''
+Wall time and peak RSS of stacking synthetic NIS 2015 Q1Q3 and Q4
+DX_PR_GRPS files, whose layouts differ: reading both in full, aligning them
+with misc.align_cols() and concatenating, versus streaming them through
+read_hcup_many() into a Parquet dataset. Each case runs in a fresh
+subprocess so that peak RSS is measured independently.
+
+Usage:
+    python benchmarks/bench_read_hcup_many.py [n_records] [chunksize]
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import resource
+import tempfile
+import subprocess
+import pandas as pd
+from jwpy.misc import Timer, align_cols
+from jwpy.sas_fwf import read_hcup, read_hcup_many
+from bench_read_hcup import fixtures, make_file
+
+names = ['NIS_2015Q1Q3_DX_PR_GRPS', 'NIS_2015Q4_DX_PR_GRPS']
+
+
+def run_case(tmp, chunksize, stream):
+    specs = [(os.path.join(tmp, x + '.fwf'),
+              os.path.join(fixtures, 'SASLoad_' + x + '.SAS')) for x in names]
+    with Timer(verbose=False) as t:
+        if stream:
+            read_hcup_many(specs, output=os.path.join(tmp, 'out'),
+                           chunksize=chunksize)
+        else:
+            q1q3, q4 = [read_hcup(*x, chunksize=chunksize, engine='numpy',
+                                  compact_dtypes=True) for x in specs]
+            q1q3, q4 = align_cols(q1q3, q4)
+            pd.concat([q1q3, q4], ignore_index=True)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(json.dumps({'seconds': t.interval, 'peak_mb': peak}))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--case']:
+        run_case(sys.argv[2], int(sys.argv[3]), json.loads(sys.argv[4]))
+        sys.exit()
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    tmp = tempfile.mkdtemp()
+    try:
+        for name in names:
+            make_file(os.path.join(tmp, name + '.fwf'), name, n_records)
+        print('Q1Q3 + Q4 DX_PR_GRPS ({} records each, chunksize {}):'.format(
+            n_records, chunksize))
+        for label, stream in [('align+concat', False),
+                              ('read_hcup_many', True)]:
+            out = subprocess.check_output(
+                [sys.executable, __file__, '--case', tmp, str(chunksize),
+                 json.dumps(stream)])
+            res = json.loads(out.decode().strip().splitlines()[-1])
+            print('  {:<15} {:8.2f} s {:9.1f} MB peak RSS'.format(
+                label, res['seconds'], res['peak_mb']))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,52 @@
+'''
+Compare jwpy.sas_fwf.stack_chunks() against the previous set-based version
+on many small chunks of the NIS Core test fixture, as read_hcup() produces
+when a large file is read with a small chunksize.
+
+Usage:
+    python benchmarks/bench_stack_chunks.py [n_chunks] [chunksize]
+'''
+from __future__ import print_function
+import os
+import sys
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup, stack_chunks
+
+fixtures = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fwf_test')
+
+
+def stack_chunks_sets(dat_list):
+    # the previous implementation, kept here for comparison
+    columns, dtypes = dat_list[0].columns, dat_list[0].dtypes
+    levels = {col: set() for col in columns}
+    for col, dt in zip(columns, dtypes):
+        if str(dt) == 'category':
+            for d in dat_list:
+                levels[col] = set.union(levels[col], d[col].cat.categories)
+            for d in dat_list:
+                _newlevels = list(levels[col] - set(d[col].cat.categories))
+                d[col] = d[col].cat.add_categories(_newlevels)
+                d[col] = d[col].cat.reorder_categories(levels[col])
+    return pd.concat(dat_list)
+
+
+if __name__ == '__main__':
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    name = 'NIS_2015_Core'
+    chunks = list(read_hcup(os.path.join(fixtures, name + '.fwf'),
+                            os.path.join(fixtures, 'SASLoad_' + name + '.SAS'),
+                            chunksize=chunksize, combine_chunks=False))
+    chunks = [chunks[i % len(chunks)] for i in range(n_chunks)]
+    print('{} chunks of {} records, {} columns:'.format(
+        n_chunks, chunksize, chunks[0].shape[1]))
+    # the old version modifies its inputs, so it gets its own copies
+    copies = [c.copy() for c in chunks]
+    print('  {:<12}'.format('sets'), end='')
+    with Timer():
+        old = stack_chunks_sets(copies)
+    print('  {:<12}'.format('recoding'), end='')
+    with Timer():
+        new = stack_chunks(chunks)
+    pd.testing.assert_frame_equal(old, new, check_categorical=False)
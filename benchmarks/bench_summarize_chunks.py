@@ -0,0 +1,57 @@
+'''
+Wall time and peak RSS of summarize_df() on a synthetic NIS Core file read
+in full versus streamed from read_hcup(..., combine_chunks=False). Each case
+runs in a fresh subprocess so that peak RSS is measured independently.
+
+Usage:
+    python benchmarks/bench_summarize_chunks.py [n_records] [chunksize]
+'''
+from __future__ import print_function
+import io
+import os
+import sys
+import json
+import shutil
+import resource
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup
+from jwpy.explore_funcs import summarize_df
+from bench_read_hcup import fixtures, make_file
+
+name = 'NIS_2015_Core'
+
+
+def run_case(data_file, chunksize, stream):
+    sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+    with Timer(verbose=False) as t, redirect_stdout(io.StringIO()):
+        summarize_df(read_hcup(data_file, sas_script, chunksize=chunksize,
+                               combine_chunks=not stream, engine='numpy',
+                               compact_dtypes=True))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(json.dumps({'seconds': t.interval, 'peak_mb': peak}))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--case']:
+        run_case(sys.argv[2], int(sys.argv[3]), json.loads(sys.argv[4]))
+        sys.exit()
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    tmp = tempfile.mkdtemp()
+    try:
+        data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                              n_records)
+        print('{} ({} records, chunksize {}):'.format(name, n_records,
+                                                      chunksize))
+        for label, stream in [('full frame', False), ('streamed', True)]:
+            out = subprocess.check_output(
+                [sys.executable, __file__, '--case', data_file,
+                 str(chunksize), json.dumps(stream)])
+            res = json.loads(out.decode().strip().splitlines()[-1])
+            print('  {:<12} {:8.2f} s {:9.1f} MB peak RSS'.format(
+                label, res['seconds'], res['peak_mb']))
+    finally:
+        shutil.rmtree(tmp)
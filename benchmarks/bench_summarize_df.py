@@ -0,0 +1,68 @@
+'''
+Time jwpy.explore_funcs.summarize_df() on a synthetic frame with the mix of
+column types of an HCUP file (categoricals, floats, nullable integers) plus
+high- and low-cardinality object columns: the previous df.nunique() summary,
+the exact and approximate modes, and the approximate mode in a thread pool.
+
+Usage:
+    python benchmarks/bench_summarize_df.py [n_rows] [n_jobs]
+'''
+from __future__ import print_function
+import io
+import sys
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.explore_funcs import summarize_df
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    columns = {}
+    for i in range(8):
+        columns['cat{}'.format(i)] = pd.Categorical(
+            rng.randint(50 * (i + 1), size=n_rows).astype(str))
+    for i in range(8):
+        x = rng.randn(n_rows).round(i)
+        x[rng.rand(n_rows) < 0.1] = np.nan
+        columns['float{}'.format(i)] = x
+    for i in range(4):
+        columns['int{}'.format(i)] = pd.array(
+            rng.randint(10**(i + 1), size=n_rows), dtype='Int32')
+    for i in range(2):
+        columns['id{}'.format(i)] = pd.Series(
+            rng.randint(10**9, size=n_rows).astype(str), dtype=object)
+        columns['text{}'.format(i)] = pd.Series(
+            rng.randint(500, size=n_rows).astype(str), dtype=object)
+    return pd.DataFrame(columns)
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    n_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    df = make_frame(n_rows)
+    print('{} rows x {} columns:'.format(*df.shape))
+    print('  {:<20}'.format('df.nunique()'), end='')
+    with Timer():
+        expected = pd.DataFrame(
+            [df.dtypes, df.nunique(dropna=False), df.isnull().mean(axis=0)],
+            index=['dtype', 'nunique', '%missing'])
+    # summarize_df() prints the shape of the frame; keep that out of the way
+    with redirect_stdout(io.StringIO()):
+        with Timer(verbose=False) as exact_time:
+            exact = summarize_df(df)
+        with Timer(verbose=False) as approx_time:
+            approx = summarize_df(df, approx=True)
+        with Timer(verbose=False) as threads_time:
+            summarize_df(df, approx=True, n_jobs=n_jobs)
+    print('  {:<20}time taken: {:f} seconds'.format('exact',
+                                                    exact_time.interval))
+    print('  {:<20}time taken: {:f} seconds'.format('approx',
+                                                    approx_time.interval))
+    print('  {:<20}time taken: {:f} seconds'.format(
+        'approx, {} threads'.format(n_jobs), threads_time.interval))
+    assert (exact.loc['nunique'] == expected.loc['nunique']).all()
+    error = (approx.loc['nunique'] / expected.loc['nunique'] - 1).abs()
+    print('  largest relative error of approx nunique: {:.4f}'.format(
+        error.max()))
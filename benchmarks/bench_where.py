@@ -0,0 +1,45 @@
+'''
+Filtering a synthetic NIS Core file while reading it: read_hcup() of every
+record followed by a boolean filter, versus read_hcup(..., where=...), which
+decodes the predicate's fields first and the rest only for matching records.
+
+Usage:
+    python benchmarks/bench_where.py [n_records]
+'''
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import pandas as pd
+from jwpy.misc import Timer
+from jwpy.sas_fwf import read_hcup
+from bench_read_hcup import fixtures, make_file
+
+name = 'NIS_2015_Core'
+predicates = ['AGE >= 65', 'AGE >= 65 and FEMALE == 1',
+              'AGE >= 80 and DQTR == 1']
+
+
+if __name__ == '__main__':
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tmp = tempfile.mkdtemp()
+    try:
+        data_file = make_file(os.path.join(tmp, name + '.fwf'), name,
+                              n_records)
+        sas_script = os.path.join(fixtures, 'SASLoad_' + name + '.SAS')
+        kwargs = dict(engine='numpy', compact_dtypes=True)
+        print('{} ({} records):'.format(name, n_records))
+        for where in predicates:
+            print('  {}'.format(where))
+            print('    {:<10}'.format('filter'), end='')
+            with Timer():
+                old = read_hcup(data_file, sas_script, **kwargs)
+                old = old[old.eval(where).fillna(False).values]
+            print('    {:<10}'.format('where='), end='')
+            with Timer():
+                new = read_hcup(data_file, sas_script, where=where, **kwargs)
+            print('    {:.1%} of records kept'.format(len(new) / n_records))
+            pd.testing.assert_frame_equal(old, new, check_categorical=False)
+    finally:
+        shutil.rmtree(tmp)
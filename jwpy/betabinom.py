@@ -1,8 +1,76 @@
 import numpy as np 
 import pandas as pd 
 import scipy as sp
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from statsmodels.base.model import GenericLikelihoodModel
 
+# fitted (a, b) of recent fits, keyed by the cache_key passed to fit()
+_WARM_START_CACHE_SIZE = 128
+_warm_starts = OrderedDict()
+# largest Newton step on log(a), log(b) in fit_many()
+_MAX_STEP = 5.
+
+
+def _split_endog(endog):
+    '''Split endog into float arrays of k (successes) and n (trials).'''
+    if isinstance(endog, pd.core.frame.DataFrame):
+        endog = endog.values
+    k, n = np.asarray(endog, dtype=float).T
+    return k, n
+
+
+def _log_choose(k, n):
+    '''Log binomial coefficient log(n choose k), via log-gamma.'''
+    return sp.special.gammaln(n + 1) - sp.special.gammaln(k + 1) \
+        - sp.special.gammaln(n - k + 1)
+
+
+def _unique_pairs(k, n):
+    '''
+    Sufficient statistics of endog: the unique (k, n) pairs, how often each
+    occurs, and the index of each observation's pair.
+    '''
+    # lexsort and compare neighbours; np.unique(axis=0) is much slower
+    order = np.lexsort((k, n))
+    k, n = k[order], n[order]
+    first = np.ones(len(k), bool)
+    first[1:] = (k[1:] != k[:-1]) | (n[1:] != n[:-1])
+    starts = np.flatnonzero(first)
+    inverse = np.empty(len(k), int)
+    inverse[order] = np.cumsum(first) - 1
+    return k[starts], n[starts], np.diff(np.append(starts, len(k))), inverse
+
+
+def _moment_start(k, n, freq, group=None, ngroups=1):
+    '''
+    Method-of-moments estimate of (a, b) from the unique (k, n) pairs and
+    their counts, for starting values. The pooled proportion gives the mean,
+    and the excess of the between-group variance over the binomial variance
+    gives the intraclass correlation rho = 1 / (a + b + 1). Falls back to
+    (2, 2) when the moments don't identify both parameters.
+
+    With group (the problem each pair belongs to), estimates ngroups
+    independent problems at once and returns an (ngroups, 2) array.
+    '''
+    if group is None:
+        return _moment_start(k, n, freq, np.zeros(len(k), int), 1)[0]
+
+    def total(x):
+        return np.bincount(group, x, minlength=ngroups)
+
+    nobs, size = total(freq), total(freq*n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = total(freq*k) / size
+        resid = total(freq*(k - n*p[group])**2 / n)
+        rho = (resid / (p*(1 - p)) - (nobs - 1)) \
+            / (size - total(freq*n**2) / size)
+    ok = np.isfinite(rho) & (p > 0) & (p < 1)
+    rho = np.clip(np.where(ok, rho, 1/5.), 1e-6, 1 - 1e-6)
+    p = np.where(ok, p, .5)
+    return np.column_stack([p, 1 - p]) * (1/rho - 1)[:, None]
+
 
 class betabinom(GenericLikelihoodModel):
     '''
@@ -10,10 +78,24 @@ class betabinom(GenericLikelihoodModel):
         endog (2-column numpy array or pandas DataFrame): 1st column gives
             k (number of successes), 2nd column gives n (total number of trials).
         kwargs: Optional keyword arguments to pass onto GenericLikelihoodModel.
+
+    The likelihood only depends on endog through the counts of each unique
+    (k, n) pair, so it's evaluated once per unique pair and weighted by the
+    counts; with many small groups that is far fewer evaluations than rows.
     '''
 
     def __init__(self, endog, **kwargs):
         super(betabinom, self).__init__(endog, extra_params_names=['a','b'], **kwargs)
+        self._k, self._n, self._freq, self._inverse = \
+            _unique_pairs(*_split_endog(self.endog))
+        # the binomial coefficient doesn't depend on a, b, so compute it once
+        self._log_choose = _log_choose(self._k, self._n)
+
+    def _pmf_log_pairs(self, a, b):
+        '''Log PMF of each unique (k, n) pair.'''
+        return self._log_choose \
+            + sp.special.betaln(self._k+a, self._n-self._k+b) \
+            - sp.special.betaln(a, b)
 
     def pmf_log(self, endog, a, b):
         '''
@@ -22,25 +104,305 @@ class betabinom(GenericLikelihoodModel):
             endog: see betabinom class docstring.
             a, b (float or array): parameters of underlying Beta distribution.
         '''
-        if isinstance(endog, pd.core.frame.DataFrame):
-            endog = endog.values
-        k, n = endog.T
-        
-        result = \
-            np.array([np.log(np.arange(i, 1, -1)).sum() for i in n]) \
-            - np.array([np.log(np.arange(i, 1, -1)).sum() for i in k]) \
-            - np.array([np.log(np.arange(i, 1, -1)).sum() for i in n-k]) \
+        if endog is self.endog:
+            return self._pmf_log_pairs(a, b)[self._inverse]
+        k, n = _split_endog(endog)
+
+        result = _log_choose(k, n) \
             + sp.special.betaln(k+a, n-k+b) \
             - sp.special.betaln(a, b)
-            
+
         return result
-        
+
+    def loglike(self, params):
+        '''Log-likelihood, summed over the unique (k, n) pairs.'''
+        return self._freq.dot(self._pmf_log_pairs(*params))
+
     def nloglikeobs(self, params):
-        ''''Evaluates the negative log-likelihood.'''
-        ll = self.pmf_log(self.endog, *params)
-        return -ll.sum()
-    
-    def fit(self, start_params=np.array([2., 2.]), **kwargs):
-        '''Estimates the model parameters.'''
-        return super(betabinom, self).fit(start_params=start_params, **kwargs)
+        '''Evaluates the negative log-likelihood of each observation.'''
+        return -self.pmf_log(self.endog, *params)
+
+    def _score_pairs(self, params):
+        '''Gradient of the log PMF of each unique (k, n) pair.'''
+        a, b = params
+        k, n = self._k, self._n
+        psi = sp.special.digamma
+        common = psi(a + b) - psi(n + a + b)
+        return np.column_stack([psi(k + a) - psi(a) + common,
+                                psi(n - k + b) - psi(b) + common])
+
+    def score_obs(self, params):
+        '''
+        Gradient of the log-likelihood of each observation, from the digamma
+        function. Returns an (nobs, 2) array with columns for a, b.
+        '''
+        return self._score_pairs(params)[self._inverse]
+
+    def score(self, params):
+        '''Gradient of the log-likelihood, from the digamma function.'''
+        return self._freq.dot(self._score_pairs(params))
+
+    def hessian(self, params):
+        '''Hessian of the log-likelihood, from the trigamma function.'''
+        a, b = params
+        k, n, freq = self._k, self._n, self._freq
+        nobs = freq.sum()
+        psi1 = partial(sp.special.polygamma, 1)
+        ab = nobs * psi1(a + b) - freq.dot(psi1(n + a + b))
+        aa = freq.dot(psi1(k + a)) - nobs * psi1(a) + ab
+        bb = freq.dot(psi1(n - k + b)) - nobs * psi1(b) + ab
+        return np.array([[aa, ab], [ab, bb]])
+
+    def start_params_moments(self):
+        '''Method-of-moments estimate of (a, b), used as fit()'s start.'''
+        return _moment_start(self._k, self._n, self._freq)
+
+    def fit(self, start_params=None, method='lbfgs', cache_key=None,
+            callback=None, **kwargs):
+        '''
+        Estimates the model parameters. The default L-BFGS-B uses the
+        analytic score and keeps a, b positive, which unconstrained methods
+        don't for strongly overdispersed data (a, b < 1); any other
+        statsmodels method can be passed instead.
+        Args:
+            start_params: starting (a, b). Defaults to the previous solution
+                for cache_key if there is one, else the method-of-moments
+                estimate.
+            method: statsmodels optimizer. For 'lbfgs', the bounds and the
+                tolerances pgtol and factr can be overridden in kwargs.
+            cache_key (hashable): e.g. the outcome and grouping variables.
+                The solution is cached under this key so that refitting the
+                same spec on updated data starts from it.
+            callback: called with the parameters after each iteration.
+            kwargs: passed onto GenericLikelihoodModel.fit().
+        Returns:
+            statsmodels results; mle_retvals['iterations'] holds the number of
+            optimizer iterations.
+        '''
+        if start_params is None:
+            if cache_key is not None and cache_key in _warm_starts:
+                start_params = _warm_starts[cache_key]
+            else:
+                start_params = self.start_params_moments()
+
+        if method == 'lbfgs':
+            # statsmodels scales the score by 1/nobs, so the tolerance on it
+            # has to be tight for the score itself to be near 0, but not so
+            # tight that the line search fails where the likelihood is flat
+            kwargs.setdefault('bounds', [(1e-8, None)] * 2)
+            kwargs.setdefault('pgtol', 1e-7)
+            kwargs.setdefault('factr', 100.)
+
+        # count iterations, which not every optimizer reports
+        iterations = [0]
+
+        def count(params, *args):
+            iterations[0] += 1
+            if callback is not None:
+                callback(params, *args)
+
+        res = super(betabinom, self).fit(start_params=start_params,
+                                         method=method, callback=count,
+                                         **kwargs)
+        res.mle_retvals.setdefault('iterations', iterations[0])
+        if cache_key is not None:
+            _warm_starts[cache_key] = np.asarray(res.params)
+            _warm_starts.move_to_end(cache_key)
+            while len(_warm_starts) > _WARM_START_CACHE_SIZE:
+                _warm_starts.popitem(last=False)
+        return res
+
+
+def _trigamma(x):
+    '''
+    Trigamma function for x > 0, from the recurrence up to x + 6 and the
+    asymptotic series there (relative error ~1e-10). Several times faster
+    than scipy's polygamma(1, x), which goes through the Hurwitz zeta.
+    '''
+    result = np.zeros_like(x)
+    for j in range(6):
+        result += 1 / (x + j)**2
+    z = x + 6
+    z2 = 1 / (z*z)
+    return result + 1/z + z2/2 \
+        + (1/6. - (1/30. - (1/42. - z2/30.)*z2)*z2)*z2/z
+
+
+def _log_rising(x, m):
+    '''
+    log(gamma(x + m) / gamma(x)) elementwise. For large x the difference of
+    gammaln cancels badly, so Stirling's series for the ratio is used there
+    (the first omitted term is O(m / x**3)).
+    '''
+    result = sp.special.gammaln(x + m) - sp.special.gammaln(x)
+    big = x >= 1e4
+    if big.any():
+        x, m = x[big], m[big]
+        result[big] = (x - .5)*np.log1p(m/x) + m*np.log(x + m) - m \
+            - m/(12*x*(x + m))
+    return result
+
 
+def _batch_loglike(theta, k, n, freq, log_choose, group, ngroups):
+    '''Log-likelihood of each problem at theta = log(a, b).'''
+    gammaln = sp.special.gammaln
+    a, b = np.exp(theta).T
+    ag, bg = a[group], b[group]
+    # log B(k + a, n - k + b) - log B(a, b) via gammaln, which is much faster
+    # than scipy's betaln
+    ll = gammaln(k + ag) + gammaln(n - k + bg) - gammaln(n + ag + bg) \
+        - (gammaln(a) + gammaln(b) - gammaln(a + b))[group]
+    # the differences cancel badly once a or b is large
+    big = (np.maximum(a, b) >= 1e4)[group]
+    if big.any():
+        ag, bg, kb, nb = ag[big], bg[big], k[big], n[big]
+        ll[big] = _log_rising(ag, kb) + _log_rising(bg, nb - kb) \
+            - _log_rising(ag + bg, nb)
+    return np.bincount(group, log_choose + freq*ll, minlength=ngroups)
+
+
+def _batch_newton_step(theta, k, n, freq, group, nobs):
+    '''
+    Gradient with respect to theta = log(a, b) of each problem's
+    log-likelihood, and its Newton step. The hessian is shifted to be negative
+    definite where it isn't, so that every step goes uphill.
+    '''
+    def total(x):
+        return np.bincount(group, x, minlength=len(nobs))
+
+    psi, psi1 = sp.special.digamma, _trigamma
+    a, b = np.exp(theta).T
+    ka, kb, nab = k + a[group], n - k + b[group], n + (a + b)[group]
+    common = nobs*psi(a + b) - total(freq*psi(nab))
+    sa = total(freq*psi(ka)) - nobs*psi(a) + common
+    sb = total(freq*psi(kb)) - nobs*psi(b) + common
+    hab = nobs*psi1(a + b) - total(freq*psi1(nab))
+    haa = total(freq*psi1(ka)) - nobs*psi1(a) + hab
+    hbb = total(freq*psi1(kb)) - nobs*psi1(b) + hab
+    # chain rule onto the log scale
+    grad = np.column_stack([a*sa, b*sb])
+    haa, hab, hbb = a*a*haa + a*sa, a*b*hab, b*b*hbb + b*sb
+    # shift by the largest eigenvalue of each 2x2 hessian, if it's not < 0
+    half = (haa + hbb) / 2
+    top = half + np.sqrt(np.maximum(half**2 - (haa*hbb - hab**2), 0))
+    shift = np.where(top < 0, 0, top + 1e-8*np.abs(half) + 1e-8)
+    haa, hbb = haa - shift, hbb - shift
+    det = haa*hbb - hab**2
+    step = -np.column_stack([hbb*grad[:, 0] - hab*grad[:, 1],
+                             haa*grad[:, 1] - hab*grad[:, 0]]) / det[:, None]
+    return grad, step
+
+
+def _fit_batch(problems, maxiter, tol):
+    '''
+    Maximum likelihood (a, b) for a list of independent problems, each given
+    as its unique (k, n) pairs and their counts. All the problems are solved
+    together by Newton's method on log(a), log(b): each iteration evaluates
+    the stacked pairs once and sums them per problem with np.bincount.
+    Problems drop out of the stack as they converge.
+    Problems with no successes (or no failures) at all have their maximum on
+    the boundary, a point mass at p = 0 (a = 0) or p = 1 (b = 0) with
+    likelihood 1; they aren't iterated, and the other parameter, which isn't
+    identified there, is NaN.
+    Returns arrays of a, b, log-likelihood, iterations, convergence and
+    whether the solution is on the boundary.
+    '''
+    ngroups = len(problems)
+    group = np.repeat(np.arange(ngroups), [len(x[0]) for x in problems])
+    k, n, freq = [np.concatenate([x[i] for x in problems] + [np.zeros(0)])
+                  for i in range(3)]
+    nobs = np.bincount(group, freq, minlength=ngroups)
+    log_choose = freq * _log_choose(k, n)
+    iterations = np.zeros(ngroups, int)
+    converged = np.zeros(ngroups, bool)
+    successes = np.bincount(group, freq*k, minlength=ngroups)
+    trials = np.bincount(group, freq*n, minlength=ngroups)
+    boundary = (nobs > 0) & ((successes == 0) | (successes == trials))
+
+    with np.errstate(all='ignore'):
+        theta = np.log(_moment_start(k, n, freq, group, ngroups))
+        llf = _batch_loglike(theta, k, n, freq, log_choose, group, ngroups)
+        active = np.flatnonzero(np.isfinite(llf) & ~boundary)
+        for _ in range(maxiter):
+            # the pairs of the problems that are still being fit
+            remap = np.full(ngroups, -1)
+            remap[active] = np.arange(len(active))
+            keep = remap[group] >= 0
+            sub = k[keep], n[keep], freq[keep]
+            sub_group, sub_nobs = remap[group[keep]], nobs[active]
+            args = sub + (log_choose[keep], sub_group, len(active))
+            old = llf[active]
+            grad, step = _batch_newton_step(theta[active], *sub + (sub_group,
+                                                                   sub_nobs))
+            # far from the optimum a full step can move a and b by dozens of
+            # orders of magnitude, so cap it on the log scale
+            step *= np.minimum(1, _MAX_STEP / np.abs(step).max(1))[:, None]
+            done = np.abs(grad).max(1) <= tol*np.maximum(sub_nobs, 1)
+            # halve the steps that don't improve the likelihood
+            t = np.where(done, 0., 1.)
+            for _ in range(30):
+                new = _batch_loglike(theta[active] + t[:, None]*step, *args)
+                # allow for rounding error once the steps are tiny, but a
+                # log-likelihood above 0 can only be rounding error
+                worse = ~(new >= old - 1e-12*np.abs(old)) | (new > 0)
+                if not worse.any():
+                    break
+                t[worse] /= 2
+            better = ~worse & ~done
+            theta[active[better]] += t[better, None]*step[better]
+            llf[active[better]] = new[better]
+            iterations[active[~done]] += 1
+            # also stop once the likelihood stops changing, e.g. as a, b run
+            # off to infinity for data with no overdispersion
+            done |= ~better | (np.abs(new - old) <= tol*np.maximum(
+                np.abs(old), 1))
+            converged[active[done]] = True
+            active = active[~done]
+            if not len(active):
+                break
+    a, b = np.exp(theta).T
+    a[boundary] = np.where(successes[boundary] == 0, 0, np.nan)
+    b[boundary] = np.where(successes[boundary] == 0, np.nan, 0)
+    llf[boundary] = np.bincount(group, log_choose,
+                                minlength=ngroups)[boundary]
+    return a, b, llf, iterations, converged, boundary
+
+
+def fit_many(endogs, maxiter=100, tol=1e-8, n_jobs=None, batch_size=1000):
+    '''
+    Fit many independent beta-binomial models, e.g. one per outcome x
+    grouping factor, without the overhead of a statsmodels fit per model.
+    The problems are stacked and solved together by a batched Newton
+    iteration.
+    Args:
+        endogs (list or dict): endog for each model; see betabinom class
+            docstring.
+        maxiter (int): maximum number of Newton iterations.
+        tol (float): convergence tolerance on the score per observation.
+        n_jobs (int): fit batches of batch_size models in this many processes.
+            By default everything is fit in this process.
+        batch_size (int): number of models per batch when n_jobs is used.
+    Returns:
+        DataFrame with a row per model (indexed by the dict keys, if any) and
+        columns a, b, llf, nobs, iterations, converged and boundary (no
+        successes or no failures: see _fit_batch).
+    '''
+    keys = list(endogs.keys()) if isinstance(endogs, dict) else None
+    endogs = endogs.values() if keys is not None else endogs
+    problems = [_unique_pairs(*_split_endog(x))[:3] for x in endogs]
+    if n_jobs is None:
+        results = [_fit_batch(problems, maxiter, tol)]
+    else:
+        batches = [problems[i:i+batch_size]
+                   for i in range(0, len(problems), batch_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_fit_batch, batches,
+                                    [maxiter]*len(batches),
+                                    [tol]*len(batches)))
+    a, b, llf, iterations, converged, boundary = \
+        [np.concatenate(x) for x in zip(*results)]
+    return pd.DataFrame({'a': a, 'b': b, 'llf': llf,
+                         'nobs': [x[2].sum() for x in problems],
+                         'iterations': iterations, 'converged': converged,
+                         'boundary': boundary},
+                        index=keys)
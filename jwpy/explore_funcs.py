@@ -1,25 +1,330 @@
+import copy
 import numpy as np 
 import pandas as pd 
 import scipy as sp
 import seaborn as sns
 import matplotlib.pyplot as plt
 from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from jwpy.betabinom import betabinom
 
 
-def summarize_df(df, head=5, dropna=False):
+def _mix64(h):
+    '''splitmix64 finalizer, to spread the bits of uint64 hashes.'''
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def _hash_text(values, batch_size=1000000):
+    '''
+    64-bit hashes of the non-missing strings of a Series, computed with numpy
+    straight from the arrow string buffers: a polynomial hash of each
+    string's bytes, mixed with its length. This is several times faster than
+    the per-object siphash of pd.util.hash_pandas_object(). Returns None if
+    the values aren't all strings or pyarrow isn't installed.
+    '''
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    try:
+        if hasattr(values.array, '__arrow_array__'):
+            arr = values.array.__arrow_array__()
+        else:
+            arr = pa.array(values.values, from_pandas=True)
+    except (ValueError, TypeError):
+        return None
+    if not (pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+        return None
+    chunks = arr.chunks if isinstance(arr, pa.ChunkedArray) else [arr]
+    result = []
+    for chunk in chunks:
+        chunk = chunk.drop_null().cast(pa.large_string())
+        for start in range(0, len(chunk), batch_size):
+            batch = chunk.slice(start, batch_size)
+            _, offsets, data = batch.buffers()
+            offsets = np.frombuffer(offsets, np.int64)[
+                batch.offset:batch.offset + len(batch) + 1]
+            data = np.frombuffer(data, np.uint8)[offsets[0]:offsets[-1]] \
+                if data is not None else np.zeros(0, np.uint8)
+            lengths = np.diff(offsets)
+            # each byte times a power of the prime for its distance from the
+            # end of its string, summed per string (wrapping mod 2**64)
+            powers = np.cumprod(np.full(max(lengths.max(initial=0), 1),
+                                        np.uint64(0x100000001b3)))
+            distance = np.repeat(offsets[1:], lengths) \
+                - np.arange(offsets[0], offsets[-1]) - 1
+            h = np.zeros(len(batch), np.uint64)
+            nonempty = lengths > 0
+            h[nonempty] = np.add.reduceat(
+                data.astype(np.uint64) * powers[distance],
+                (offsets[:-1] - offsets[0])[nonempty])
+            result.append(_mix64(h ^ lengths.astype(np.uint64)))
+    return np.concatenate(result) if result else np.zeros(0, np.uint64)
+
+
+class _HyperLogLog(object):
+    '''
+    HyperLogLog sketch of the number of distinct values, with 2**p registers
+    (relative standard error about 1.04 / sqrt(2**p)). Sketches of different
+    chunks of a column can be merged.
+    '''
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(2**p, dtype=np.uint8)
+
+    def update(self, values):
+        '''Add the non-missing values of a Series to the sketch.'''
+        h = _hash_text(values)
+        if h is None:
+            h = pd.util.hash_pandas_object(values.dropna(), index=False,
+                                           categorize=False).values
+        # the first p bits pick the register, which keeps the position of the
+        # highest set bit among the rest (< 2**53, so exact as a float)
+        rest = (h & np.uint64(2**(64 - self.p) - 1)).astype(np.float64)
+        rank = 64 - self.p + 1 - np.frexp(rest)[1]
+        np.maximum.at(self.registers, (h >> np.uint64(64 - self.p)).astype(int),
+                      rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        '''Combine with the sketch of another chunk of the same column.'''
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m**2 \
+            / np.ldexp(1., -self.registers.astype(int)).sum()
+        zeros = (self.registers == 0).sum()
+        # linear counting is more accurate for small counts
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / float(zeros))
+        return float(np.round(estimate))
+
+    @property
+    def relative_se(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+
+def _nunique_exact(col, dropna):
+    '''
+    Number of unique values in a Series, without hashing categorical and
+    numeric columns: categoricals count the codes that occur, and numeric
+    columns use np.bincount or np.unique on a compact copy.
+    '''
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.values
+        missing = codes < 0
+        nunique = np.count_nonzero(np.bincount(codes[~missing]))
+    elif col.dtype.kind in 'biuf':
+        # nullable integer columns are converted to plain numpy arrays
+        missing = col.isnull().values
+        values = col[~missing].to_numpy(
+            dtype=getattr(col.dtype, 'numpy_dtype', col.dtype))
+        if values.dtype.kind in 'biu' and len(values):
+            if values.dtype.kind == 'b':
+                values = values.view(np.uint8)
+            # the shift can wrap around in signed types, but read as unsigned
+            # of the same size it is the exact offset from the minimum, even
+            # for int64 ranges above 2**63 and for uint64
+            values = (values - values.min()).view(
+                'u{}'.format(values.dtype.itemsize))
+            top = values.max()
+            if top < 2 * len(values):
+                nunique = np.count_nonzero(np.bincount(values.astype(np.intp)))
+            else:
+                # sort the smallest integer type that holds the range
+                for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+                    if top <= np.iinfo(dtype).max:
+                        nunique = len(np.unique(values.astype(dtype)))
+                        break
+        else:
+            nunique = len(np.unique(values))
+    else:
+        return col.nunique(dropna=dropna)
+    return int(nunique + (not dropna and missing.any()))
+
+
+def _summarize_column(col, dropna, approx, sample_size):
+    '''
+    dtype, number of unique values, and fraction missing of a Series, with
+    the standard errors of the latter two (zero if computed exactly).
+    '''
+    rows = np.random.RandomState(0).randint(len(col), size=sample_size) \
+        if approx and len(col) > sample_size else None
+    # a hash table of the values is fast when there are few of them, so only
+    # sketch text/object columns whose sample is mostly distinct values
+    if rows is not None and not (isinstance(col.dtype, pd.CategoricalDtype)
+                                 or col.dtype.kind in 'biuf') \
+            and col.iloc[rows].nunique() > sample_size / 2:
+        sketch = _HyperLogLog().update(col)
+        nunique = sketch.estimate() + (not dropna and col.hasnans)
+        nunique_se = sketch.relative_se * nunique
+    else:
+        nunique, nunique_se = _nunique_exact(col, dropna), 0.
+    if rows is not None:
+        missing = col.iloc[rows].isnull().mean()
+        missing_se = np.sqrt(missing * (1 - missing) / sample_size)
+    else:
+        missing, missing_se = col.isnull().mean(), 0.
+    return col.dtype, nunique, missing, nunique_se, missing_se
+
+
+def _combine_dtypes(a, b):
+    '''dtype of the concatenation of columns of dtypes a and b.'''
+    if a == b:
+        return a
+    if isinstance(a, pd.CategoricalDtype) and \
+            isinstance(b, pd.CategoricalDtype):
+        return pd.CategoricalDtype()
+    try:
+        return np.result_type(a, b)
+    except TypeError:
+        return np.dtype(object)
+
+
+class SummaryState(object):
+    '''
+    Summary of a DataFrame built a chunk at a time in constant memory, e.g.
+    from read_hcup(..., combine_chunks=False). States of different chunks can
+    be merged, so the chunks can also be summarized in parallel. Usage:
+    ```
+    state = SummaryState()
+    for chunk in chunks:
+        state.update(chunk)
+    summ = state.summary()
+    ```
+    Categorical columns count their observed categories exactly; other
+    columns use HyperLogLog sketches (about 1% error). Missing fractions are
+    exact.
+    Args:
+        head: number of rows to keep for the summary's head.
+        dropna: don't count missing values as a unique value.
+    '''
+
+    def __init__(self, head=5, dropna=False):
+        self.head_rows = head
+        self.dropna = dropna
+        self.nrows = 0
+        self.head = None
+        self.dtypes = OrderedDict()
+        self.missing = {}
+        self.levels = {}
+        self.sketches = {}
+
+    def update(self, chunk):
+        '''Add a DataFrame chunk to the summary. Returns self.'''
+        state = SummaryState(self.head_rows, self.dropna)
+        state.nrows = len(chunk)
+        state.head = chunk.head(self.head_rows)
+        for name, col in chunk.items():
+            state.dtypes[name] = col.dtype
+            state.missing[name] = int(col.isnull().sum())
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                codes = col.cat.codes.values
+                seen = np.bincount(codes[codes >= 0],
+                                   minlength=len(col.cat.categories)) > 0
+                state.levels[name] = set(col.cat.categories[seen])
+            else:
+                # numbers are hashed as floats so that an int chunk and a
+                # float chunk of the same column agree
+                if col.dtype.kind in 'biuf':
+                    col = col.astype('float64')
+                state.sketches[name] = _HyperLogLog().update(col)
+        return self.merge(state)
+
+    def merge(self, other):
+        '''Combine with the state of other chunks. Returns self.'''
+        self.nrows += other.nrows
+        if self.head is None or len(self.head) < self.head_rows:
+            heads = [x for x in [self.head, other.head] if x is not None]
+            if heads:
+                self.head = pd.concat(heads).head(self.head_rows)
+        for name, dtype in other.dtypes.items():
+            if name not in self.dtypes:
+                self.dtypes[name] = dtype
+                self.missing[name] = 0
+            else:
+                self.dtypes[name] = _combine_dtypes(self.dtypes[name], dtype)
+            self.missing[name] += other.missing[name]
+            if name in other.levels:
+                self.levels.setdefault(name, set()).update(other.levels[name])
+            if name in other.sketches:
+                if name in self.sketches:
+                    self.sketches[name].merge(other.sketches[name])
+                else:
+                    self.sketches[name] = copy.deepcopy(other.sketches[name])
+        return self
+
+    def summary(self):
+        '''
+        Summary in the format of summarize_df(approx=True): dtype, nunique,
+        %missing, their standard errors, and the head.
+        '''
+        stats = OrderedDict()
+        for name, dtype in self.dtypes.items():
+            missing = self.missing[name]
+            nunique, nunique_se = 0., 0.
+            if name in self.levels:
+                nunique = float(len(self.levels[name]))
+            if name in self.sketches:
+                # a column that was categorical in some chunks only
+                sketch = self.sketches[name]
+                nunique = max(nunique, sketch.estimate())
+                nunique_se = sketch.relative_se * nunique
+            nunique += not self.dropna and missing > 0
+            stats[name] = [dtype, nunique, missing / float(max(self.nrows, 1)),
+                           nunique_se, 0.]
+        summ = pd.DataFrame(stats, index=['dtype', 'nunique', '%missing',
+                                          'nunique_se', '%missing_se'])
+        return pd.concat([summ, self.head], axis=0)
+
+
+def summarize_df(df, head=5, dropna=False, approx=False, sample_size=100000,
+                 n_jobs=None):
     '''
     Quick summary of a pandas DataFrame.
     Args:
-        df:
+        df: a DataFrame, or an iterable of DataFrame chunks (e.g., from
+            read_hcup(..., combine_chunks=False)), which is summarized in one
+            pass in constant memory with a SummaryState.
         head:
         dropna:
+        approx: for frames longer than sample_size, estimate the fraction
+            missing from a sample of sample_size rows, and the number of
+            unique values of mostly-distinct text/object columns with a
+            HyperLogLog sketch (about 1% error), instead of computing them
+            exactly. Adds the standard errors of both to the summary.
+            Categorical and numeric columns are always counted exactly,
+            without hashing.
+        sample_size: number of rows sampled for the fraction missing.
+        n_jobs: summarize the columns in a pool of this many threads.
     '''
 
+    if not isinstance(df, pd.DataFrame):
+        state = SummaryState(head=head, dropna=dropna)
+        for chunk in df:
+            state.update(chunk)
+        print('{} rows x {} columns'.format(state.nrows, len(state.dtypes)))
+        return state.summary()
+
     # show variable types and numbers of unique levels
-    summ = pd.DataFrame(
-        [df.dtypes, df.nunique(dropna=dropna), df.isnull().mean(0)],
-        index=['dtype', 'nunique', '%missing'])
+    columns = [df.iloc[:, i] for i in range(df.shape[1])]
+    summarize = partial(_summarize_column, dropna=dropna, approx=approx,
+                        sample_size=sample_size)
+    if n_jobs is None:
+        stats = [summarize(col) for col in columns]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            stats = list(pool.map(summarize, columns))
+    index = ['dtype', 'nunique', '%missing', 'nunique_se', '%missing_se']
+    summ = pd.DataFrame(list(zip(*stats)), index=index, columns=df.columns)
+    if not approx:
+        summ = summ.iloc[:3]
     # append head
     summ = pd.concat([summ, df.head(head)], axis=0)
 
@@ -39,7 +344,179 @@ def shrink(values, a, b):
     return (a + ones)/(a + b + zeros + ones)
 
 
-def aov_xtab(values, index, columns, figsize=(13, 8), **kwargs):
+def shrink_counts(k, n, a, b):
+    '''
+    Same as shrink(), but from the number of successes and trials, so it can
+    be applied to arrays of counts for many groups at once.
+    Args:
+        k: number of successes (scalar, array, or Series)
+        n: number of trials, same shape as k
+        a, b: parameters of the Beta prior
+    '''
+    return (a + k)/(a + b + n)
+
+
+def _factorize(x):
+    '''
+    Integer codes (-1 for missing) and sorted levels of a grouping factor,
+    keeping only the levels that occur. Ordered categoricals keep the order
+    of their categories, as groupby does; the levels of unordered ones are
+    sorted by value, the same as for the values themselves. Categoricals are
+    recoded from their codes, without hashing their values again.
+    '''
+    if isinstance(getattr(x, 'dtype', None), pd.CategoricalDtype):
+        x = pd.Categorical(x)
+        codes = np.asarray(x.codes, dtype=np.int64)
+        used = np.flatnonzero(np.bincount(codes[codes >= 0],
+                                          minlength=len(x.categories)))
+        levels = x.categories[used]
+        order = np.arange(len(used)) if x.ordered else levels.argsort()
+        # code -1 (missing) maps to -1 through the last slot
+        lookup = np.full(len(x.categories) + 1, -1)
+        lookup[used[order]] = np.arange(len(used))
+        return lookup[codes], levels[order]
+    if not isinstance(x, (pd.Series, pd.Index)):
+        x = np.asarray(x)
+    return pd.factorize(x, sort=True)
+
+
+class CrossTabStats(object):
+    '''
+    Per-cell counts of a binary outcome over one or two grouping factors,
+    computed in a single pass: each factor is factorized once and the cells
+    are tallied with np.bincount. The same counts give the beta-binomial
+    endog, the number of observations per cell, and the shrunken cell means.
+    Args:
+        values: binary (integer or boolean) DV; missing values are not counted
+            as trials.
+        index: row grouping factor, same length as values.
+        columns: optional column grouping factor. Without it the stats are
+            one-dimensional (Series instead of DataFrames).
+    Attributes:
+        k, n: arrays of successes and trials per cell (rows x columns).
+        size: array of observations per cell, including missing values.
+        a, b: parameters of the Beta prior, once fit() has been called.
+    '''
+
+    def __init__(self, values, index, columns=None):
+        values = pd.Series(np.asarray(values)).astype(float).values
+        row_codes, self.index = _factorize(index)
+        self.index = pd.Index(self.index, name=getattr(index, 'name', None))
+        if columns is None:
+            self.columns = None
+            cell, shape = row_codes, (len(self.index),)
+        else:
+            col_codes, self.columns = _factorize(columns)
+            self.columns = pd.Index(self.columns,
+                                    name=getattr(columns, 'name', None))
+            cell = row_codes * len(self.columns) + col_codes
+            cell[col_codes < 0] = -1
+            shape = (len(self.index), len(self.columns))
+        # rows with a missing grouping factor are dropped, as in groupby
+        keep = cell >= 0
+        valid = keep & ~np.isnan(values)
+        size = int(np.prod(shape))
+        self.k = np.bincount(cell[valid], values[valid], size).reshape(shape)
+        self.n = np.bincount(cell[valid], minlength=size).reshape(shape)
+        self.size = np.bincount(cell[keep], minlength=size).reshape(shape)
+        self.a = self.b = None
+
+    def _frame(self, x):
+        if self.columns is None:
+            return pd.Series(x, index=self.index)
+        return pd.DataFrame(x, index=self.index, columns=self.columns)
+
+    @property
+    def endog(self):
+        '''DataFrame of k and n for each non-empty cell, for betabinom.'''
+        k, n = self._frame(self.k), self._frame(self.n)
+        if self.columns is not None:
+            k, n = k.stack(), n.stack()
+        endog = pd.DataFrame({'k': k, 'n': n})
+        return endog[self._frame(self.size).values.ravel() > 0]
+
+    @property
+    def counts(self):
+        '''Number of observations per cell, as from pd.crosstab().'''
+        return self._frame(self.size)
+
+    def fit(self, **kwargs):
+        '''
+        Fit the beta-binomial prior to the non-empty cells.
+        Args:
+            kwargs: passed onto betabinom.fit().
+        Returns:
+            self
+        '''
+        self.a, self.b = betabinom(endog=self.endog).fit(**kwargs).params
+        return self
+
+    def top(self, max_index=None, max_columns=None, other='(other)'):
+        '''
+        Keep the most frequent levels of each factor and pool the rest into a
+        single level, e.g. so that a plot of the stats has a bounded size.
+        Args:
+            max_index, max_columns (int): maximum number of levels to keep,
+                including the pooled one. None keeps them all.
+            other: label of the pooled level.
+        Returns:
+            a new CrossTabStats, with the same prior if fit.
+        '''
+        result = copy.copy(self)
+        limits = [(0, 'index', max_index)]
+        if self.columns is not None:
+            limits.append((1, 'columns', max_columns))
+        for axis, name, limit in limits:
+            levels = getattr(result, name)
+            if limit is None or len(levels) <= limit:
+                continue
+            totals = result.size.sum(axis=1 - axis) if result.size.ndim > 1 \
+                else result.size
+            keep = np.sort(np.argsort(-totals, kind='stable')[:limit - 1])
+            pooled = np.ones(len(levels), bool)
+            pooled[keep] = False
+            for attr in ['k', 'n', 'size']:
+                x = getattr(result, attr)
+                setattr(result, attr, np.concatenate(
+                    [x.take(keep, axis),
+                     x.compress(pooled, axis).sum(axis, keepdims=True)],
+                    axis))
+            setattr(result, name, levels[keep].append(
+                pd.Index([other], name=levels.name)))
+        return result
+
+    @property
+    def shrunk(self):
+        '''
+        Shrunken cell means. Empty cells get the prior mean a / (a + b).
+        '''
+        if self.a is None:
+            raise ValueError('call fit() before using the shrunken means')
+        return self._frame(shrink_counts(self.k, self.n, self.a, self.b))
+
+
+def _variance_decomposition(shrunk):
+    '''SDs of the row means, column means and interaction of a matrix.'''
+    rows, columns = shrunk.mean(axis=1), shrunk.mean(axis=0)
+    interaction = shrunk.sub(rows, axis=0).sub(columns, axis=1)
+    return pd.Series([rows.std(), columns.std(), interaction.stack().std()],
+                     index=['rows', 'columns', 'interaction'])
+
+
+def _sort_xtab(stats):
+    '''Shrunken means and counts, sorted by the row/column means.'''
+    shrunk = stats.shrunk
+    new_index = shrunk.index[np.argsort(-shrunk.mean(axis=1).values,
+                                        kind='stable')]
+    new_columns = shrunk.columns[np.argsort(-shrunk.mean(axis=0).values,
+                                            kind='stable')]
+    shrunk = shrunk.reindex(index=new_index, columns=new_columns)
+    counts = stats.counts.reindex(index=new_index, columns=new_columns)
+    return shrunk, counts
+
+
+def aov_xtab(values, index, columns, figsize=(13, 8), plot=True,
+             max_levels=40, **kwargs):
     '''
     Exploratory plot for pairs of categorical predictors/features.
     Args:
@@ -47,88 +524,73 @@ def aov_xtab(values, index, columns, figsize=(13, 8), **kwargs):
         index:
         columns:
         figsize:
-        kwargs:
-    '''
-
-    # group the variables into a DataFrame
-    dat = pd.DataFrame({
-        'values': values,
-        'index': index,
-        'columns': columns})
-
-    # fit the beta-binomial model
-    endog = pd.DataFrame({
-        'k': dat.groupby(['index', 'columns'])['values'].sum(),
-        'n': dat.groupby(['index', 'columns'])['values'].count()})
-    a, b = betabinom(endog=endog).fit(**kwargs).params
-    m = a / (a + b)
-
-    # compute the shrunken cell means and sort the matrix by row/column means
-    shrunk = pd.pivot_table(dat, values='values', index='index',
-                            columns='columns',
-                            aggfunc=partial(shrink, a=a, b=b), fill_value=m)
-    new_index = shrunk.index[shrunk.mean(1).argsort()[::-1]]
-    new_columns = shrunk.columns[shrunk.mean(0).argsort()[::-1]]
-    shrunk = shrunk.reindex_axis(new_index, axis=0)
-    shrunk = shrunk.reindex_axis(new_columns, axis=1)
-
-    # compute the numbers of obs. per cell and sort by the same means as above
-    annot = pd.crosstab(dat['index'], dat['columns'])
-    annot = annot.reindex_axis(new_index, axis=0)
-    annot = annot.reindex_axis(new_columns, axis=1)
+        plot: if False, return the results as data instead of plotting them.
+        max_levels (int): the heatmap shows at most this many rows and
+            columns; the least frequent levels beyond that are pooled into an
+            '(other)' row/column. None plots every level.
+        kwargs: passed onto betabinom.fit().
+    Returns:
+        the heatmap's Axes or, if plot=False, a dict with the sorted shrunken
+        means ('shrunk'), the numbers of obs. per cell ('counts'), and the SDs
+        of the row means, column means and interaction ('sd').
+    '''
+
+    # count the cells and fit the beta-binomial model
+    stats = CrossTabStats(values, index, columns).fit(**kwargs)
+
+    # sort the shrunken cell means and numbers of obs. per cell by the
+    # row/column means, and decompose the variance of the shrunken means
+    shrunk, counts = _sort_xtab(stats)
+    sd = _variance_decomposition(shrunk)
+    if not plot:
+        return {'shrunk': shrunk, 'counts': counts, 'sd': sd}
 
     # print stuff
-    print('SD of row means: {}'.format(shrunk.mean(1).std()))
-    print('SD of column means: {}'.format(shrunk.mean(0).std()))
-    interaction = shrunk.sub(shrunk.mean(1), axis=0).sub(shrunk.mean(0), axis=1)
-    print('SD of row*column interaction: {}'.format(interaction.stack().std()))
+    print('SD of row means: {}'.format(sd['rows']))
+    print('SD of column means: {}'.format(sd['columns']))
+    print('SD of row*column interaction: {}'.format(sd['interaction']))
 
-    # plot!
+    # plot! drawing is the slow part for big tables, so bound its size
+    shrunk, counts = _sort_xtab(stats.top(max_levels, max_levels))
     fig, ax = plt.subplots(figsize=figsize)
-    return sns.heatmap(shrunk, annot=annot, fmt='.0f');
+    return sns.heatmap(shrunk, annot=counts, fmt='.0f');
 
 
-def shrink_1d(target, group, sort=True, **kwargs):
+def shrink_1d(target, group, sort=True, figsize=(13, 8), plot=True,
+              max_levels=40, **kwargs):
     '''
-    Exploratory plot for pairs of categorical predictors/features.
+    Exploratory plot of the shrunken means of a binary DV by one categorical
+    predictor/feature.
     Args:
         target: binary (integer or boolean) DV
         group: grouping factor
-        sort:
-        kwargs:
-    '''
-
-    # group the variables into a DataFrame
-    dat = pd.DataFrame({
-        'target': target,
-        'group': group})
-
-    # fit the beta-binomial model
-    endog = pd.DataFrame({
-        'k': dat.groupby('group')['target'].sum(),
-        'n': dat.groupby('group')['target'].count()})
-    a, b = betabinom(endog=endog).fit(**kwargs).params
-    m = a / (a + b)
-
-    # compute the shrunken cell means and sort the matrix by row/column means
-    shrunk = pd.pivot_table(dat, values='values', index='index',
-        columns='columns', aggfunc=partial(shrink, a=a, b=b), fill_value=m)
-    new_index = shrunk.index[shrunk.mean(1).argsort()[::-1]]
-    new_columns = shrunk.columns[shrunk.mean(0).argsort()[::-1]]
-    shrunk = shrunk.reindex_axis(new_index, axis=0)
-    shrunk = shrunk.reindex_axis(new_columns, axis=1)
-
-    # compute the numbers of obs. per cell and sort by the same means as above
-    annot = pd.crosstab(dat['index'], dat['columns'])
-    annot = annot.reindex_axis(new_index, axis=0)
-    annot = annot.reindex_axis(new_columns, axis=1)
+        sort: sort the groups by their shrunken means
+        figsize:
+        plot: if False, return the shrunken group means instead of plotting
+            them.
+        max_levels (int): plot at most this many groups; the least frequent
+            groups beyond that are pooled into an '(other)' group. None plots
+            every group.
+        kwargs: passed onto betabinom.fit().
+    '''
+
+    # count the groups and fit the beta-binomial model
+    stats = CrossTabStats(target, group).fit(**kwargs)
+
+    # compute the shrunken group means and sort them
+    shrunk = stats.shrunk
+    if sort:
+        shrunk = shrunk.sort_values(ascending=False, kind='stable')
+    if not plot:
+        return shrunk
 
     # print stuff
-    print('SD of row means: {}'.format(shrunk.mean(1).std()))
-    print('SD of column means: {}'.format(shrunk.mean(0).std()))
-    interaction = shrunk.sub(shrunk.mean(1), axis=0).sub(shrunk.mean(0), axis=1)
-    print('SD of row*column interaction: {}'.format(interaction.stack().std()))
+    print('SD of group means: {}'.format(shrunk.std()))
 
     # plot!
+    shown = stats.top(max_levels).shrunk
+    if sort:
+        shown = shown.sort_values(ascending=False, kind='stable')
     fig, ax = plt.subplots(figsize=figsize)
-    return sns.heatmap(shrunk, annot=annot, fmt='.0f');
+    return sns.barplot(x=shown.values, y=shown.index.astype(str),
+                       orient='h', ax=ax);
@@ -1,8 +1,8 @@
 import timeit
 import gc
+import re
 import numpy as np
 import pandas as pd
-from operator import xor
 
 # convenience variable for filling in new python scripts
 header = '''import numpy as np
@@ -63,10 +63,106 @@ class Timer:
             print('time taken: %f seconds' % self.interval)
 
 
+def _shared_levels(parts):
+    '''
+    One category dictionary for a column from several frames: the sorted
+    union of the categories of the categorical parts and the values of the
+    others.
+    '''
+    levels = [x.cat.categories if isinstance(x.dtype, pd.CategoricalDtype)
+              else pd.Index(x.dropna().unique()) for x in parts]
+    levels = levels[0].append(levels[1:]).unique()
+    try:
+        return levels.sort_values()
+    except TypeError:
+        # mixed types that can't be compared keep the order they appear in
+        return levels
+
+
+def _category_lookup(source, target):
+    '''
+    Lookup table from the codes of categories source to positions in target
+    (-1 where absent). Code -1 (missing) maps to -1 through the last slot.
+    '''
+    return np.append(target.get_indexer(source), -1)
+
+
+def _union_categorical(parts, ordered=False):
+    '''
+    One CategoricalDtype for a column split across several Series (see
+    _shared_levels) and each part's codes in it. Categorical parts are
+    recoded through integer lookup tables, so their values are never compared
+    row by row, and other parts are looked up directly.
+    '''
+    dtype = pd.CategoricalDtype(_shared_levels(parts), ordered=ordered)
+    codes = [_category_lookup(x.cat.categories, dtype.categories)[
+                 x.cat.codes.values]
+             if isinstance(x.dtype, pd.CategoricalDtype)
+             else dtype.categories.get_indexer(x.values) for x in parts]
+    return dtype, codes
+
+
+def _float32_exact(x):
+    '''True if a float64 Series survives a round trip through float32.'''
+    values = x.values
+    return np.array_equal(values.astype(np.float32), values, equal_nan=True)
+
+
+def align_frames(*dfs, **kwargs):
+    '''
+    Align any number of dataframes column-wise, in one pass, to prepare them
+    for being stacked with pandas.concat(). Every frame gets the union of the
+    columns (missing ones are filled with NaN), categoricals get one shared
+    set of categories so they won't be cast to 'object' during stacking, and
+    float64 columns are downcast to float32 where that loses nothing, to save
+    memory. The input frames are not modified.
+
+    Args:
+        dfs: The dataframes to align.
+        downcast (bool, default True): Downcast float64 columns to float32
+            when every frame's values are exactly representable.
+
+    Returns:
+        A list of the aligned dataframes, in the same order.
+    '''
+    downcast = kwargs.pop('downcast', True)
+    if kwargs:
+        raise TypeError('unexpected keyword arguments: {}'.format(
+            ', '.join(kwargs)))
+    # union of the columns, in the order they first appear
+    columns = pd.Index([]).append([df.columns for df in dfs]).unique()
+    aligned = [{} for df in dfs]
+    for col in columns:
+        parts = [df[col] if col in df.columns else None for df in dfs]
+        present = [x for x in parts if x is not None]
+        if any(isinstance(x.dtype, pd.CategoricalDtype) for x in present):
+            # recode every part into the shared categories with integer
+            # lookup tables instead of re-adding and reordering categories
+            dtype, codes = _union_categorical(present)
+            codes = iter(codes)
+            for i, x in enumerate(parts):
+                aligned[i][col] = pd.Categorical.from_codes(
+                    np.full(len(dfs[i]), -1) if x is None else next(codes),
+                    dtype=dtype)
+            continue
+        dtype = None
+        if downcast and all(x.dtype == np.float64 for x in present) \
+                and all(_float32_exact(x) for x in present):
+            dtype = np.float32
+        for i, x in enumerate(parts):
+            if x is None:
+                x = np.full(len(dfs[i]), np.nan, dtype=dtype or np.float64)
+            elif dtype is not None:
+                x = x.values.astype(dtype)
+            aligned[i][col] = x
+    return [pd.DataFrame(d, index=df.index, columns=columns)
+            for d, df in zip(aligned, dfs)]
+
+
 def align_cols(df1, df2):
     '''
-    Wrapper for pandas.DataFrame.align(..., axis=1) to prepare dataframes for
-    being stacked with pandas.concat(). Makes categoricals have the same
+    Wrapper for align_frames() with two dataframes, to prepare them for being
+    stacked with pandas.concat(). Makes categoricals have the same
     categories so they won't be case to 'object' during stacking, and downcasts
     float64 types to float32 where possible to save memory.
 
@@ -77,29 +173,36 @@ def align_cols(df1, df2):
     Returns:
         A tuple containing (df1_aligned, df2_aligned).
     '''
-    # align using pandas
-    p1, p2 = df1.align(df2, axis=1)
-    # define empty sets to hold the categories of each categorical
-    levels = {col: set() for col in p1.columns}
-    for col in levels.keys():
-        # preserve categories
-        check = str(p1[col].dtype) == 'category', str(p2[col].dtype) == 'category'
-        if check[0] | check[1]:
-            # make sure they're BOTH categoricals first
-            if xor(check[0], check[1]):
-                if check.index(True):
-                    p1[col] = p1[col].astype('category')
-                else:
-                    p2[col] = p2[col].astype('category')
-            # make sure both categoricals have the same categories
-            for d in (p1, p2):
-                levels[col] = set.union(levels[col], d[col].cat.categories)
-            for d in (p1, p2):
-                _newlevels = list(levels[col] - set(d[col].cat.categories))
-                d[col] = d[col].cat.add_categories(_newlevels)
-                d[col] = d[col].cat.reorder_categories(levels[col])
-
-    return p1, p2
+    return tuple(align_frames(df1, df2))
+
+
+def compare_memory(before, after):
+    '''
+    Per-column memory usage of two versions of the same DataFrame, e.g. one
+    read with read_hcup(..., compact_dtypes=True) and one without.
+
+    Args:
+        before, after: The two DataFrames to compare. Only columns present in
+            both are compared.
+
+    Returns:
+        A DataFrame with one row per column (plus a 'total' row) giving the
+        dtypes and bytes (deep memory usage) before and after, the bytes
+        saved, and the ratio of bytes before to bytes after.
+    '''
+    cols = [x for x in before.columns if x in after.columns]
+    report = pd.DataFrame({
+        'dtype_before': before[cols].dtypes.astype(str),
+        'dtype_after': after[cols].dtypes.astype(str),
+        'bytes_before': before[cols].memory_usage(index=False, deep=True),
+        'bytes_after': after[cols].memory_usage(index=False, deep=True)},
+        columns=['dtype_before', 'dtype_after', 'bytes_before',
+                 'bytes_after'])
+    report.loc['total'] = ['', '', report['bytes_before'].sum(),
+                           report['bytes_after'].sum()]
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report['ratio'] = report['bytes_before'] / report['bytes_after']
+    return report
 
 
 def hcup_datadict(col_names):
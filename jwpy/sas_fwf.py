@@ -1,35 +1,1153 @@
+import io
+import os
+import re
+import json
+import hashlib
+import operator
 import numpy as np
 import pandas as pd
-import re
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from jwpy.misc import _category_lookup, _union_categorical
+
+# the strings pandas treats as missing by default, so that the numpy engine
+# can match the NA handling of pd.read_fwf()
+try:
+    from pandas._libs.parsers import STR_NA_VALUES as _DEFAULT_NA_VALUES
+except ImportError:
+    from pandas.io.common import _NA_VALUES as _DEFAULT_NA_VALUES
+
+# byte values used when decoding raw fixed-width records
+_SPACE, _TAB, _MINUS, _POINT, _ZERO = (ord(x) for x in ' \t-.0')
+
+# parsed SAS layouts, most recently used last. bump _LAYOUT_VERSION whenever
+# the parsing changes so that stale layouts cached on disk are ignored
+_LAYOUT_VERSION = 1
+_LAYOUT_CACHE_SIZE = 128
+_layouts = OrderedDict()
+
+# dimension tables for read_hcup(..., join=...), most recently used last
+_DIMENSION_CACHE_SIZE = 16
+_dimensions = OrderedDict()
 
 
 def stack_chunks(dat_list):
     '''
     For preserving categories instead of converting to objects.
     If you concat categories w/ different levels (or even the same in a
-    different order), it silently converts to object
-    '''
-    columns, dtypes = dat_list[0].columns, dat_list[0].dtypes
-    # preserve categories
-    levels = {col: set() for col in columns}
-    for col, dt in zip(columns, dtypes):
-        if str(dt) == 'category':
-            for d in dat_list:
-                levels[col] = set.union(levels[col], d[col].cat.categories)
-            for d in dat_list:
-                _newlevels = list(levels[col] - set(d[col].cat.categories))
-                d[col] = d[col].cat.add_categories(_newlevels)
-                d[col] = d[col].cat.reorder_categories(levels[col])
+    different order), it silently converts to object.
+
+    Each categorical column gets the sorted union of the chunks' categories in
+    a single pass, and each chunk's integer codes are recoded into it through
+    a lookup table, so the string categories are never compared row by row.
+    The input DataFrames are not modified.
+    '''
+    dat_list = list(dat_list)
+    first = dat_list[0]
+    index = first.index.append([d.index for d in dat_list[1:]])
+    columns = OrderedDict()
+    for col in first.columns:
+        parts = [d[col] for d in dat_list]
+        if not all(isinstance(x.dtype, pd.CategoricalDtype) for x in parts):
+            # keep the Series, since newer pandas would infer a string dtype
+            # for a bare object array where pd.concat() keeps object
+            columns[col] = pd.concat(parts, ignore_index=True).set_axis(index)
+            continue
+        dtype, codes = _union_categorical(parts,
+                                          ordered=first[col].cat.ordered)
+        columns[col] = pd.Categorical.from_codes(np.concatenate(codes),
+                                                 dtype=dtype)
     # recombine the chunks and return the result
-    return pd.concat(dat_list)
+    return pd.DataFrame(columns, columns=first.columns, index=index)
+
+
+class SasLayout(object):
+    '''
+    Field layout parsed from a SAS load script. Use get_layout() to build
+    these, since it caches them.
+
+    Attributes:
+        names (list): Field names, in file order
+        starts (list): 1-based starting position of each field
+        widths (list): Width of each field in bytes
+        informats (list): SAS informat of each field, without the trailing
+            period (e.g. 'N3PF', '$CHAR7'). MHOS scripts only mark text
+            fields, so there it is '$' or ''
+        labels (list): Variable label of each field ('' if there is none)
+        na_codes (dict): For each informat defined by an INVALUE block, a dict
+            mapping its missing-value codes to the SAS missing values they
+            stand for ('.', '.A', '.C', ...)
+        lrecl (int): Logical record length, or None if not given
+        digest (str): Hash of the script contents the layout was parsed from
+    '''
+    _attrs = ['names', 'starts', 'widths', 'informats', 'labels', 'na_codes',
+              'lrecl', 'digest']
+
+    def __init__(self, names, starts, widths, informats, labels, na_codes,
+                 lrecl=None, digest=None):
+        self.names = names
+        self.starts = starts
+        self.widths = widths
+        self.informats = informats
+        self.labels = labels
+        self.na_codes = na_codes
+        self.lrecl = lrecl
+        self.digest = digest
+
+    def __repr__(self):
+        return '<SasLayout: {} fields, LRECL={}>'.format(len(self.names),
+                                                         self.lrecl)
+
+    def __eq__(self, other):
+        return isinstance(other, SasLayout) and \
+            self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        return {x: getattr(self, x) for x in self._attrs}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    @property
+    def na_values(self):
+        '''Every missing-value code in the script, plus '.'.'''
+        return [code for codes in self.na_codes.values() for code in codes] \
+            + ['.']
+
+    @property
+    def field_na_values(self):
+        '''The missing-value codes of each field's informat, plus '.'.'''
+        return OrderedDict(
+            (name, list(self.na_codes.get(informat, {})) + ['.'])
+            for name, informat in zip(self.names, self.informats))
+
+    @property
+    def special_missing(self):
+        '''
+        For each field whose informat has special missing values (.A, .C, ...),
+        a dict mapping those codes to their missing reason (see
+        _missing_reason).
+        '''
+        special = OrderedDict()
+        for name, informat in zip(self.names, self.informats):
+            codes = {code: _missing_reason(value) for code, value
+                     in self.na_codes.get(informat, {}).items()}
+            codes = {k: v for k, v in codes.items() if v}
+            if codes:
+                special[name] = codes
+        return special
+
+
+def _missing_reason(value):
+    '''
+    Small-int code of a SAS missing value: 0 for '.', 1-26 for the special
+    missing values '.A' to '.Z', and 27 for '._'.
+    '''
+    value = value.upper()
+    if value == '._':
+        return 27
+    if len(value) == 2 and value[0] == '.' and value[1].isalpha():
+        return ord(value[1]) - ord('A') + 1
+    return 0
+
+
+def _parse_hcup_layout(sas):
+    '''Parse the lines of an HCUP SAS load script into a SasLayout.'''
+    text = ''.join(sas)
+
+    # grab the lines that define the fields. returns three match groups:
+    # 0 = starting position, 1 = field name, 2 = variable type
+    fields = [re.search(r'@\s*(\d+)\s+(\S+)\s+(\S+)\s?', x) for x in sas]
+    fields = [x.groups() for x in fields if x]
+    starts = [int(x[0]) for x in fields]
+    names = [x[1] for x in fields]
+    informats = [x[2].rstrip('.') for x in fields]
+
+    # compute the variable widths
+    lrecl = int(re.search(r'LRECL = (.+);', text).group(1))
+    widths = [int(x) for x in np.diff(starts + [lrecl+1])]
+
+    # missing value codes of each INVALUE informat, e.g. '-99' = .A
+    na_codes = OrderedDict()
+    for informat, body in re.findall(r'INVALUE\s+(\S+)(.*?);', text, re.S):
+        na_codes[informat] = OrderedDict(
+            re.findall(r'\'(.+)\' = (\S+)', body))
+
+    # variable labels from the ATTRIB statement
+    labels = dict(re.findall(r'(\S+)\s+LENGTH=[^\n]*\s+LABEL="([^"]*)"',
+                             text))
+    labels = [labels.get(x, '') for x in names]
+
+    return SasLayout(names, starts, widths, informats, labels, na_codes,
+                     lrecl)
+
+
+def _parse_mhos_layout(sas):
+    '''Parse the lines of an MHOS SAS load script into a SasLayout.'''
+    # match groups (indexed from 1, not 0)
+    # 1 = prefix, 2 = field name, 3 = string, 4 = start position,
+    # 5 = end position, 6 = field number, 7 = field description
+    regex = r'^\s+(&[c|C].|&[r|R].|&[p|P].)?(\S+)\s+(\$)?\s*(\d{1,3})-?(\d{1,3})?\S*\s*/\*\s+(\d{1,3})(.*)\*/'
+    fields = [re.search(regex, x) for x in sas if re.search(regex, x)]
+
+    # check that we matched all and only the the right field numbers
+    assert [int(x.group(6)) for x in fields if x] \
+        == list(range(1, len(fields)+1))
+
+    # extract the meta-data
+    prefix = [x.group(1) for x in fields]
+    names = [x.group(2).lower() for x in fields]
+    informats = ['$' if x.group(3) else '' for x in fields]
+    starts = [int(x.group(4)) for x in fields]
+    ends = [int(x.group(5)) if x.group(5) else int(x.group(4)) for x in fields]
+    widths = [end - start + 1 for start, end in zip(starts, ends)]
+    descriptions = [x.group(7).strip() for x in fields]
+
+    # handle duplicate names
+    vc = pd.Series(names).value_counts()
+    dupes = list(vc.index[vc > 1])
+    dupes = [x in dupes for x in names]
+    names = [prefix+name if dupe else name
+             for prefix, name, dupe in zip(prefix, names, dupes)]
+
+    return SasLayout(names, starts, widths, informats, descriptions, {})
+
+
+_layout_parsers = {'hcup': _parse_hcup_layout, 'mhos': _parse_mhos_layout}
+
+
+def get_layout(sas_script, kind='hcup', cache_dir=None):
+    '''
+    Parse a SAS load script into a SasLayout, with caching. Layouts are kept
+    in an in-memory LRU cache and in JSON files on disk, both keyed by a hash
+    of the script contents, so re-opening files that share a layout skips
+    parsing altogether.
+
+    Arguments:
+        sas_script (str): Path of the SAS load file
+        kind (str, default 'hcup'): 'hcup' or 'mhos', the style of the script
+        cache_dir (str, default None): Directory for the on-disk cache. By
+            default this is $JWPY_CACHE_DIR, or ~/.cache/jwpy if that is not
+            set. False disables the on-disk cache
+
+    Returns:
+        A SasLayout
+    '''
+    if kind not in _layout_parsers:
+        raise ValueError('kind must be one of {}, not "{}"'.format(
+            sorted(_layout_parsers), kind))
+    with open(sas_script, 'rb') as f:
+        content = f.read()
+    key = '{}-{}-'.format(kind, _LAYOUT_VERSION).encode() + content
+    digest = hashlib.sha1(key).hexdigest()
+
+    # in-memory cache
+    if digest in _layouts:
+        _layouts[digest] = _layouts.pop(digest)
+        return _layouts[digest]
+
+    # on-disk cache, or else parse the script
+    if cache_dir is None:
+        cache_dir = os.environ.get(
+            'JWPY_CACHE_DIR',
+            os.path.join(os.path.expanduser('~'), '.cache', 'jwpy'))
+    path = cache_dir and os.path.join(cache_dir, 'sas_layouts',
+                                      digest + '.json')
+    layout = None
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                layout = SasLayout.from_dict(
+                    json.load(f, object_pairs_hook=OrderedDict))
+        except (OSError, ValueError, TypeError):
+            layout = None
+    if layout is None:
+        sas = content.decode('utf-8', 'replace').splitlines(True)
+        layout = _layout_parsers[kind](sas)
+        layout.digest = digest
+        if path:
+            # write atomically, and never fail a read over the cache
+            try:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                tmp = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(layout.to_dict(), f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    _layouts[digest] = layout
+    while len(_layouts) > _LAYOUT_CACHE_SIZE:
+        _layouts.popitem(last=False)
+    return layout
+
+
+def _compact_dtype(informat, width):
+    '''
+    Smallest dtype that exactly holds every value a field can take, judging
+    by its SAS informat and width: 'category' for CHAR fields, a nullable
+    integer type for integer informats (N3PF, ...), float32 for decimal
+    informats (N5P2F, ...) of at most 6 significant digits, and float64
+    otherwise.
+    '''
+    if 'CHAR' in informat or informat == '$':
+        return 'category'
+    match = re.match(r'N(\d+)P(\d*)F$', informat)
+    if not match:
+        return 'float64'
+    if not match.group(2):
+        # with a possible minus sign, a width of w holds up to w digits
+        for limit, dtype in ((2, 'Int8'), (4, 'Int16'), (9, 'Int32'),
+                             (18, 'Int64')):
+            if width <= limit:
+                return dtype
+        return 'float64'
+    # one of the bytes is the decimal point
+    return 'float32' if width - 1 <= 6 else 'float64'
+
+
+def _select_columns(names, columns):
+    '''
+    Positions of the fields to read, in file order.
+
+    Arguments:
+        names (list): All field names defined in the SAS script
+        columns (list or str): Field names, regular expressions matched
+            against whole names, or HCUP grouped-variable stems ending in "n"
+            (e.g., "I10_DXn" for I10_DX1, I10_DX2, ...; see
+            misc.hcup_datadict). None selects every field
+    '''
+    if columns is None:
+        return list(range(len(names)))
+    if isinstance(columns, str):
+        columns = [columns]
+    keep = set()
+    for spec in columns:
+        if spec in names:
+            matches = [names.index(spec)]
+        else:
+            patterns = [r'(?:{})$'.format(spec)]
+            if spec.endswith('n'):
+                patterns.append(re.escape(spec[:-1]) + r'\d+$')
+            matches = [i for i, name in enumerate(names)
+                       if any(re.match(x, name) for x in patterns)]
+        if not matches:
+            raise KeyError('no fields match "{}"'.format(spec))
+        keep.update(matches)
+    return sorted(keep)
+
+
+def _record_length(data_file, lrecl):
+    '''
+    Length in bytes of one record of a fixed-width file, i.e., LRECL plus the
+    line terminator (which may be '\n', '\r\n', or nothing at all).
+    '''
+    with open(data_file, 'rb') as f:
+        first = f.read(lrecl + 2)
+    if first[lrecl:lrecl+2] == b'\r\n':
+        return lrecl + 2
+    if first[lrecl:lrecl+1] in (b'\n', b'\r'):
+        return lrecl + 1
+    return lrecl
+
+
+def _records_from_bytes(buf, lrecl, reclen, source=''):
+    '''
+    View a buffer of whole fixed-length records as a 2-D uint8 array with one
+    row per record and one column per byte (line terminators are dropped).
+    '''
+    # the last record may be missing its line terminator
+    if len(buf) % reclen:
+        buf += b'\n' * (reclen - len(buf) % reclen)
+    block = np.frombuffer(buf, dtype=np.uint8).reshape(-1, reclen)
+    # drop trailing blank lines, which pandas.read_fwf() skips too
+    n = len(block)
+    while n and np.isin(block[n-1], (9, 10, 13, 32)).all():
+        n -= 1
+    block = block[:n]
+    if reclen > lrecl and not np.isin(block[:, lrecl:], (10, 13)).all():
+        raise ValueError(
+            '{} does not consist of fixed-length records of {} bytes; use '
+            'engine="pandas"'.format(source, lrecl))
+    return block[:, :lrecl]
+
+
+def _iter_records(data_file, lrecl, chunksize, nrows=None):
+    '''
+    Read a fixed-width file in chunks of `chunksize` records, yielding each
+    chunk as a 2-D uint8 array (see _records_from_bytes).
+    '''
+    reclen = _record_length(data_file, lrecl)
+    with open(data_file, 'rb') as f:
+        while nrows is None or nrows > 0:
+            n = chunksize if nrows is None else min(chunksize, nrows)
+            buf = f.read(n * reclen)
+            if not buf.strip():
+                break
+            block = _records_from_bytes(buf, lrecl, reclen, data_file)
+            if nrows is not None:
+                nrows -= len(block)
+            yield block
+
+
+def _split_file(data_file, chunksize):
+    '''
+    Split a file into byte ranges (offset, length) of about `chunksize` lines
+    each, judging line length from the first line. Every range ends on a line
+    boundary, so for fixed-length records each holds exactly `chunksize`.
+    '''
+    size = os.path.getsize(data_file)
+    ranges, offset = [], 0
+    with open(data_file, 'rb') as f:
+        step = chunksize * len(f.readline())
+        while offset < size:
+            end = min(offset + step, size)
+            if end < size:
+                f.seek(end - 1)
+                end += len(f.readline()) - 1
+            ranges.append((offset, end - offset))
+            offset = end
+    return ranges
+
+
+def _read_range(data_file, offset, length, engine, kwargs):
+    '''
+    Worker for _read_parallel(): parse `length` bytes of `data_file` starting
+    at `offset`, either with the numpy decoder or with pandas.read_fwf().
+    Returns the parsed records, indexed from 0 at `offset`, and the number
+    of records in the range (which differ if the numpy engine filtered them).
+    '''
+    with open(data_file, 'rb') as f:
+        f.seek(offset)
+        buf = f.read(length)
+    if engine == 'numpy':
+        block = _records_from_bytes(buf, kwargs['lrecl'],
+                                    _record_length(data_file, kwargs['lrecl']),
+                                    data_file)
+        n = len(block)
+        index = pd.RangeIndex(n)
+        keep_default_na = kwargs.get('keep_default_na', True)
+        encoding = kwargs.get('encoding', 'utf-8')
+        if kwargs.get('where') is not None:
+            mask = kwargs['where'].mask_block(block, keep_default_na,
+                                              encoding)
+            block, index = block[mask], index[mask]
+        return _decode_block(block, kwargs['names'], kwargs['starts'],
+                             kwargs['widths'], kwargs['dtype'],
+                             _column_na(kwargs['na_values'], kwargs['names'],
+                                        keep_default_na),
+                             encoding, index, kwargs.get('reasons')), n
+    dat = pd.read_fwf(io.BytesIO(buf), **kwargs)
+    return dat, len(dat)
+
+
+def _astype_chunks(dat, dtype):
+    '''Generator that casts the columns of each chunk of `dat`.'''
+    for chunk in dat:
+        yield chunk.astype(dtype)
+
+
+def _read_parallel(data_file, chunksize, n_jobs, engine, kwargs):
+    '''
+    Generator that parses chunks of `data_file` in a pool of `n_jobs`
+    processes, yielding the chunks in file order with the same row index the
+    serial readers produce. At most 2*n_jobs chunks are in flight at once.
+    '''
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    for x in ('nrows', 'skiprows', 'skipfooter'):
+        if x in kwargs:
+            raise ValueError('{} is not supported with n_jobs'.format(x))
+    ranges = iter(_split_file(data_file, chunksize))
+    row = 0
+    with ProcessPoolExecutor(n_jobs) as pool:
+        pending = deque(pool.submit(_read_range, data_file, offset, length,
+                                    engine, kwargs)
+                        for offset, length in islice(ranges, 2 * n_jobs))
+        while pending:
+            dat, n = pending.popleft().result()
+            for offset, length in islice(ranges, 1):
+                pending.append(pool.submit(_read_range, data_file, offset,
+                                           length, engine, kwargs))
+            dat.index = dat.index + row
+            row += n
+            yield dat
+
+
+def _field_keys(field):
+    '''
+    Turn a 2-D uint8 array of field bytes into a 1-D array with one hashable,
+    sortable key per record (packed integers for narrow fields).
+    '''
+    n, width = field.shape
+    for size, kind in ((1, np.uint8), (2, np.uint16), (4, np.uint32),
+                       (8, np.uint64)):
+        if width <= size:
+            packed = np.zeros((n, size), dtype=np.uint8)
+            packed[:, :width] = field
+            return packed.view(kind).ravel()
+    return np.ascontiguousarray(field).view('S{}'.format(width)).ravel()
+
+
+def _unique_tokens(field, encoding='utf-8'):
+    '''
+    The distinct stripped, decoded values of a 2-D uint8 array of field
+    bytes, plus the position of each record's value in that list.
+    '''
+    keys = _field_keys(field)
+    _, first, inverse = np.unique(keys, return_index=True,
+                                  return_inverse=True)
+    tokens = [field[i].tobytes().strip(b' \t').decode(encoding)
+              for i in first]
+    return tokens, inverse.ravel()
+
+
+def _parse_text(field, na_values, dtype, encoding='utf-8'):
+    '''
+    Decode a text field from a 2-D uint8 array of field bytes. Each distinct
+    byte string is only stripped, decoded and checked against `na_values`
+    once, and the result is built from integer codes.
+    '''
+    tokens, inverse = _unique_tokens(field, encoding)
+    categories = sorted(set(x for x in tokens if x not in na_values))
+    lookup = {x: i for i, x in enumerate(categories)}
+    codes = np.array([lookup.get(x, -1) for x in tokens],
+                     dtype=np.int64)[inverse]
+    if str(dtype) == 'category':
+        return pd.Categorical.from_codes(codes, categories=categories)
+    values = np.array(categories + [np.nan], dtype=object)[codes]
+    return pd.Series(values, dtype=dtype).values
+
+
+def _parse_numeric(field, na_values, encoding='utf-8'):
+    '''
+    Decode a numeric field from a 2-D uint8 array of field bytes into a
+    float64 array. Regular values ([-]digits[.digits] padded with blanks) are
+    parsed with whole-column integer arithmetic, one byte position at a time;
+    anything else falls back to Python's float() for just those records.
+    '''
+    n, width = field.shape
+    mantissa = np.zeros(n, dtype=np.int64)
+    decimals = np.zeros(n, dtype=np.int64)
+    ndigits = np.zeros(n, dtype=np.int64)
+    npoints = np.zeros(n, dtype=np.int64)
+    nminus = np.zeros(n, dtype=np.int64)
+    # a record is irregular if it has stray characters, or if its
+    # non-blank characters are not contiguous or in the wrong order
+    irregular = np.zeros(n, dtype=bool)
+    started = np.zeros(n, dtype=bool)
+    ended = np.zeros(n, dtype=bool)
+    for j in range(width):
+        col = field[:, j]
+        digit = col - _ZERO
+        is_digit = digit < 10
+        is_point = col == _POINT
+        is_minus = col == _MINUS
+        is_blank = (col == _SPACE) | (col == _TAB)
+        irregular |= ~(is_digit | is_point | is_minus | is_blank)
+        irregular |= ended & ~is_blank
+        irregular |= is_minus & started
+        ended |= started & is_blank
+        started |= ~is_blank
+        mantissa = np.where(is_digit, mantissa * 10 + digit, mantissa)
+        decimals += is_digit & (npoints > 0)
+        ndigits += is_digit
+        npoints += is_point
+        nminus += is_minus
+    irregular |= (npoints > 1) | (ndigits > 15) | ((ndigits == 0) & started)
+
+    # 10.0**decimals is exact, so this division is correctly rounded
+    values = mantissa / 10.0 ** decimals
+    values[nminus > 0] *= -1
+    values[~started] = np.nan
+    for i in np.flatnonzero(irregular):
+        token = field[i].tobytes().strip(b' \t').decode(encoding)
+        values[i] = np.nan if token in na_values else float(token)
+
+    # numeric NA codes are matched by value, as pandas does
+    na_floats = []
+    for x in na_values:
+        try:
+            na_floats.append(float(x))
+        except ValueError:
+            pass
+    values[np.isin(values, na_floats)] = np.nan
+    return values
+
+
+def _parse_reason(field, codes, encoding='utf-8'):
+    '''
+    Missing reason (see _missing_reason) of every record of a field, given
+    the dict of special missing codes of the field's informat.
+    '''
+    tokens, inverse = _unique_tokens(field, encoding)
+    return np.array([codes.get(x, 0) for x in tokens], dtype=np.int8)[inverse]
+
+
+class _ReasonConverter(object):
+    '''Picklable pandas.read_fwf() converter from values to missing reasons.'''
+    def __init__(self, codes):
+        self.codes = codes
+
+    def __call__(self, x):
+        return self.codes.get(x.strip(), 0)
+
+
+def _na_set(na_values, keep_default_na=True):
+    '''Set of strings treated as missing, including the pandas defaults.'''
+    na_values = set(na_values)
+    if keep_default_na:
+        na_values |= set(_DEFAULT_NA_VALUES)
+    return na_values
+
+
+def _column_na(na_values, names, keep_default_na=True):
+    '''
+    Set of strings treated as missing in each column, from either a single
+    list for all columns or a dict of lists keyed by column name.
+    '''
+    if isinstance(na_values, dict):
+        return {name: _na_set(na_values.get(name, []), keep_default_na)
+                for name in names}
+    na_values = _na_set(na_values, keep_default_na)
+    return {name: na_values for name in names}
+
+
+def _to_nullable_int(values, dtype):
+    '''Convert float64 values (NaN for missing) to a pandas IntegerArray.'''
+    mask = np.isnan(values)
+    values = np.where(mask, 0, values)
+    if (values != np.trunc(values)).any():
+        raise ValueError('non-integer values in {} field'.format(dtype))
+    return pd.arrays.IntegerArray(values.astype(str(dtype).lower()), mask)
+
+
+def _decode_field(block, start, width, dtype, na_values, encoding='utf-8'):
+    '''
+    Decode one field (1-based `start`, `width` bytes) of a 2-D uint8 array of
+    records into the array type implied by `dtype`.
+    '''
+    field = block[:, start-1:start-1+width]
+    if str(dtype) in ('category', 'object') or dtype is str:
+        return _parse_text(field, na_values, dtype, encoding)
+    values = _parse_numeric(field, na_values, encoding)
+    if str(dtype) in ('Int8', 'Int16', 'Int32', 'Int64'):
+        return _to_nullable_int(values, dtype)
+    return values.astype(dtype, copy=False)
+
+
+def _decode_block(block, names, starts, widths, dtype, na_values,
+                  encoding='utf-8', index=None, reasons=None):
+    '''
+    Decode the given fields of a 2-D uint8 array of records. `na_values` maps
+    each name to its set of NA strings, and for fields in the optional dict
+    `reasons` (of special missing codes) a '<name>_reason' column is added.
+    '''
+    reasons = reasons or {}
+    columns = OrderedDict()
+    for name, start, width in zip(names, starts, widths):
+        columns[name] = _decode_field(block, start, width, dtype[name],
+                                      na_values[name], encoding)
+        if name in reasons:
+            field = block[:, start-1:start-1+width]
+            columns[name + '_reason'] = _parse_reason(field, reasons[name],
+                                                      encoding)
+    if index is None:
+        index = pd.RangeIndex(len(block))
+    return _records_frame(columns, list(columns), index)
+
+
+def _records_frame(columns, names, index):
+    '''
+    DataFrame of decoded columns. Object arrays are wrapped as object Series
+    first, since newer pandas would otherwise infer a string dtype for them
+    where pandas.read_fwf() keeps object.
+    '''
+    columns = OrderedDict(
+        (name, pd.Series(x, index=index, dtype=object)
+         if isinstance(x, np.ndarray) and x.dtype == object else x)
+        for name, x in columns.items())
+    return pd.DataFrame(columns, columns=names, index=index)
+
+
+# comparisons allowed in read_hcup(..., where=[(column, op, value), ...])
+_WHERE_OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+              '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+              'in': lambda x, v: x.isin(v),
+              'not in': lambda x, v: ~x.isin(v)}
+
+
+class _RowFilter(object):
+    '''
+    Picklable row predicate of read_hcup(..., where=...), with the layout of
+    the fields it needs. Text fields are compared as strings and all other
+    fields as numbers, whatever dtypes the columns are read with.
+    '''
+    def __init__(self, where, layout, compact_dtypes=False):
+        if isinstance(where, str):
+            # the fields are the identifiers in the expression
+            tokens = set(re.findall(r'[A-Za-z_]\w*', where))
+            names = [x for x in layout.names if x in tokens]
+        else:
+            where = [tuple(x) for x in where]
+            names = []
+            for name, op, _ in where:
+                if op not in _WHERE_OPS:
+                    raise ValueError('op must be one of {}, not "{}"'.format(
+                        sorted(_WHERE_OPS), op))
+                if name not in layout.names:
+                    raise KeyError('no field "{}"'.format(name))
+                if name not in names:
+                    names.append(name)
+        keep = [layout.names.index(x) for x in names]
+        self.where = where
+        self.names = names
+        self.starts = [layout.starts[i] for i in keep]
+        self.widths = [layout.widths[i] for i in keep]
+        dtype = [_compact_dtype(layout.informats[i], layout.widths[i])
+                 if compact_dtypes else 'category'
+                 if 'CHAR' in layout.informats[i] else float for i in keep]
+        self.dtype = dict(zip(names, [str if x == 'category' else x
+                                      for x in dtype]))
+        field_na = layout.field_na_values
+        self.na_values = {x: field_na[x] for x in names}
+
+    def mask(self, dat):
+        '''Boolean mask of the rows of `dat` that match; NaN never matches.'''
+        if isinstance(self.where, str):
+            result = dat.eval(self.where)
+        else:
+            result = np.ones(len(dat), dtype=bool)
+            for name, op, value in self.where:
+                match = pd.Series(_WHERE_OPS[op](dat[name], value),
+                                  dtype='boolean')
+                result = result & match.fillna(False).to_numpy(dtype=bool)
+        return pd.Series(result, dtype='boolean').fillna(False) \
+            .to_numpy(dtype=bool)
+
+    def mask_block(self, block, keep_default_na=True, encoding='utf-8'):
+        '''Decode just the predicate's fields of a block and match them.'''
+        na_values = _column_na(self.na_values, self.names, keep_default_na)
+        return self.mask(_decode_block(block, self.names, self.starts,
+                                       self.widths, self.dtype, na_values,
+                                       encoding))
+
+    def mask_chunk(self, chunk):
+        '''Match the rows of an already parsed chunk.'''
+        dat = OrderedDict()
+        for name in self.names:
+            x = chunk[name]
+            if self.dtype[name] is str:
+                dat[name] = x.astype(object)
+            elif isinstance(x.dtype, pd.CategoricalDtype) or \
+                    pd.api.types.is_object_dtype(x.dtype):
+                dat[name] = pd.to_numeric(x.astype(object))
+            else:
+                dat[name] = x
+        return self.mask(pd.DataFrame(dat, index=chunk.index))
+
+
+def _filter_chunks(chunks, row_filter, drop):
+    '''
+    Generator applying a _RowFilter to each chunk, then dropping columns.
+    Categoricals keep only the categories of the matching records, the same
+    as the numpy engine, which only decodes those.
+    '''
+    for chunk in chunks:
+        chunk = chunk[row_filter.mask_chunk(chunk)].drop(columns=drop)
+        for col in chunk.columns:
+            if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                chunk[col] = chunk[col].cat.remove_unused_categories()
+        yield chunk
+
+
+def _read_fwf_numpy(data_file, names, starts, widths, dtype, na_values,
+                    lrecl, chunksize, nrows=None, keep_default_na=True,
+                    encoding='utf-8', reasons=None, where=None):
+    '''
+    Generator that reads a file of fixed-length records in chunks and decodes
+    every field with numpy, as a much faster alternative to pd.read_fwf().
+
+    Arguments:
+        data_file (str): Path of fixed-width text data file
+        names, starts, widths, dtype: field names, 1-based starting positions,
+            widths, and dtypes (dict keyed by name), as built by read_hcup()
+        na_values (list or dict): Strings to treat as missing, for all
+            columns or per column
+        lrecl (int): Logical record length from the SAS script
+        chunksize (int): Number of records to decode per yielded DataFrame
+        nrows, keep_default_na, encoding: as in pandas.read_fwf()
+        reasons (dict): Special missing codes of the fields to add missing
+            reason columns for
+        where (_RowFilter): Only decode the fields of the records it matches
+    '''
+    na_values = _column_na(na_values, names, keep_default_na)
+    row = 0
+    for block in _iter_records(data_file, lrecl, chunksize, nrows):
+        index = pd.RangeIndex(row, row + len(block))
+        row += len(block)
+        if where is not None:
+            mask = where.mask_block(block, keep_default_na, encoding)
+            block, index = block[mask], index[mask]
+        yield _decode_block(block, names, starts, widths, dtype, na_values,
+                            encoding, index, reasons)
+
+
+class FixedWidthFile(object):
+    '''
+    Lazy, memory-mapped access to a file of fixed-length records. Nothing is
+    parsed up front; indexing decodes only the byte ranges of the requested
+    columns (and rows), straight from the memory-mapped file. Usage:
+    ```
+    f = FixedWidthFile('NIS_2015_Core.ASC', 'SASLoad_NIS_2015_Core.SAS')
+    age = f['AGE']
+    dat = f[['AGE', 'DRG', 'DIED']]
+    head = f.read(['AGE', 'DIED'], rows=slice(0, 100))
+    some = f.lookup([10000116, 10000228], columns=['AGE', 'DIED'])
+    ```
+
+    Arguments:
+        data_file (str): Path of fixed-width text data file
+        meta (dict or str): Metadata from read_hcup(..., return_meta=True), or
+            the path of the SAS load file to build it from
+        keep_default_na (bool, default True): Also treat the pandas default NA
+            strings as missing
+        encoding (str, default 'utf-8'): Encoding of text fields
+    '''
+    def __init__(self, data_file, meta, keep_default_na=True,
+                 encoding='utf-8'):
+        if not isinstance(meta, dict):
+            meta = read_hcup(data_file, meta, return_meta=True)
+        self.data_file = data_file
+        self.meta = meta
+        self.encoding = encoding
+        self.na_values = _column_na(meta['na_values'], meta['names'],
+                                    keep_default_na)
+        self._fields = {name: (start, width) for name, start, width
+                        in zip(meta['names'], meta['starts'], meta['widths'])}
+        self._key_indexes = {}
+
+        # view the file as a 2-D array of records without reading it. the
+        # strides skip over the line terminators, and the last record may be
+        # missing its terminator
+        lrecl = meta['lrecl']
+        reclen = _record_length(data_file, lrecl)
+        self._mmap = np.memmap(data_file, dtype=np.uint8, mode='r')
+        n = (len(self._mmap) + reclen - lrecl) // reclen
+        self._records = np.lib.stride_tricks.as_strided(
+            self._mmap, shape=(n, lrecl), strides=(reclen, 1),
+            writeable=False)
+
+    @property
+    def columns(self):
+        return pd.Index(self.meta['names'])
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return '<FixedWidthFile {!r}: {} records x {} columns>'.format(
+            self.data_file, len(self), len(self.columns))
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, tuple, pd.Index)):
+            return self.read(list(key))
+        return self.read([key])[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Release the memory map of the underlying file.'''
+        self._records = self._mmap = None
+
+    def read(self, columns=None, rows=None):
+        '''
+        Decode some or all of the columns for some or all of the records.
+
+        Arguments:
+            columns (list, default None): Names of the columns to decode
+                (default all)
+            rows (slice or array of int or bool, default None): Which records
+                to decode (default all). Only the selected records are copied
+                out of the file
+
+        Returns:
+            A pandas DataFrame indexed by record number
+        '''
+        if columns is None:
+            columns = self.meta['names']
+        missing = [x for x in columns if x not in self._fields]
+        if missing:
+            raise KeyError('columns not in {}: {}'.format(self.data_file,
+                                                          missing))
+        index = pd.RangeIndex(len(self))
+        block = self._records
+        if rows is not None:
+            index = index[rows]
+            block = block[rows]
+        dtypes = self.meta['dtypes']
+        dat = {name: _decode_field(block, *self._fields[name],
+                                   dtype=dtypes[name],
+                                   na_values=self.na_values[name],
+                                   encoding=self.encoding)
+               for name in columns}
+        return _records_frame(dat, columns, index)
+
+    def key_index(self, key='KEY_NIS'):
+        '''
+        Sorted index of a key field: its non-missing values in ascending
+        order, and the record number of each. The index is built once by
+        decoding just the key field, and saved in a sidecar file next to the
+        data file ('<data_file>.<key>.idx.npz') that is reused for as long as
+        the data file's size and modification time don't change.
+
+        Arguments:
+            key (str, default 'KEY_NIS'): Name of the key field
+
+        Returns:
+            A tuple (keys, rows) of numpy arrays
+        '''
+        if key not in self._key_indexes:
+            self._key_indexes[key] = _load_key_index(self, key)
+        return self._key_indexes[key]
+
+    def lookup(self, keys, columns=None, key='KEY_NIS'):
+        '''
+        Decode the records with the given values of a key field, finding them
+        through key_index() and reading only those records from the file.
+
+        Arguments:
+            keys (array-like): Key values to look up. Keys not in the file
+                are skipped, and a key in several records returns all of them
+            columns (list, default None): Names of the columns to decode
+                (default all)
+            key (str, default 'KEY_NIS'): Name of the key field
+
+        Returns:
+            A pandas DataFrame indexed by record number, with the records in
+            the order of `keys`
+        '''
+        sorted_keys, rows = self.key_index(key)
+        keys = np.asarray(keys, dtype=float).ravel()
+        left = np.searchsorted(sorted_keys, keys, side='left')
+        counts = np.searchsorted(sorted_keys, keys, side='right') - left
+        # positions left, left+1, ..., right-1 of every key, in key order
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return self.read(columns, rows=rows[np.repeat(left, counts) +
+                                            offsets])
+
+
+def _key_index_stamp(data_file):
+    '''Size and modification time that a saved key index must match.'''
+    stat = os.stat(data_file)
+    return np.array([stat.st_size, int(stat.st_mtime * 1e6)], dtype=np.int64)
+
+
+def _load_key_index(f, key):
+    '''
+    Load the sidecar key index of a FixedWidthFile, or build it (and try to
+    save it) if it is missing or stale.
+    '''
+    path = '{}.{}.idx.npz'.format(f.data_file, key)
+    stamp = _key_index_stamp(f.data_file)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as saved:
+                if np.array_equal(saved['stamp'], stamp):
+                    return saved['keys'], saved['rows']
+        except (OSError, ValueError, KeyError):
+            pass
+    values = f[key].values.astype(float)
+    rows = np.flatnonzero(~np.isnan(values))
+    rows = rows[np.argsort(values[rows], kind='mergesort')]
+    keys = values[rows]
+    # write atomically, and never fail a read over the sidecar
+    try:
+        tmp = '{}.{}.tmp.npz'.format(path[:-len('.npz')], os.getpid())
+        np.savez(tmp, keys=keys, rows=rows, stamp=stamp)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return keys, rows
+
+
+def join_hcup(files, keys=None, columns=None, on='KEY_NIS', chunksize=500000):
+    '''
+    Streaming inner join of several HCUP files on a key field, e.g. Core with
+    DX_PR_GRPS and Severity on KEY_NIS, without parsing any file in full. The
+    keys are walked in sorted order, chunksize at a time, and each file's
+    matching records are found through its key_index() and decoded straight
+    from the memory-mapped file. Usage:
+    ```
+    files = [('NIS_2015_Core.ASC', 'SASLoad_NIS_2015_Core.SAS'),
+             ('NIS_2015Q1Q3_Severity.ASC',
+              'SASLoad_NIS_2015Q1Q3_Severity.SAS')]
+    dat = pd.concat(join_hcup(files, keys=patients))
+    ```
+
+    Arguments:
+        files (list): FixedWidthFiles, (data_file, meta) tuples, or dicts of
+            FixedWidthFile() arguments that may also give the columns to
+            take from that file
+        keys (array-like, default None): Only join the records with these
+            keys (default every key of the first file)
+        columns (list, default None): Columns to take from every file without
+            columns of its own (default all). A column already taken from an
+            earlier file is not repeated
+        on (str, default 'KEY_NIS'): Name of the key field, which must be
+            unique within each file
+        chunksize (int, default 500K): Number of keys joined at a time
+
+    Returns:
+        Generator of pandas DataFrames, in key order
+    '''
+    opened, file_columns = [], []
+    for spec in files:
+        if isinstance(spec, FixedWidthFile):
+            opened.append(spec)
+            file_columns.append(columns)
+            continue
+        spec = dict(spec) if isinstance(spec, dict) else \
+            {'data_file': spec[0], 'meta': spec[1]}
+        file_columns.append(spec.pop('columns', columns))
+        opened.append(FixedWidthFile(**spec))
+    indexes = [f.key_index(on) for f in opened]
+    for f, (sorted_keys, _) in zip(opened, indexes):
+        if (np.diff(sorted_keys) == 0).any():
+            raise ValueError('{} is not unique in {}'.format(on, f.data_file))
+    if keys is None:
+        keys = indexes[0][0]
+    else:
+        keys = np.unique(np.asarray(keys, dtype=float))
+        keys = keys[~np.isnan(keys)]
+    return _join_chunks(opened, indexes, file_columns, keys, on, chunksize)
+
+
+def _join_chunks(files, indexes, file_columns, keys, on, chunksize):
+    '''Generator of the joined chunks of join_hcup().'''
+    row = 0
+    for start in range(0, len(keys), chunksize):
+        chunk_keys = keys[start:start+chunksize]
+        # position of each key in each file's sorted keys, keeping only the
+        # keys found in every file
+        positions = []
+        found = np.ones(len(chunk_keys), dtype=bool)
+        for sorted_keys, _ in indexes:
+            pos = np.searchsorted(sorted_keys, chunk_keys)
+            pos = np.minimum(pos, max(len(sorted_keys) - 1, 0))
+            if len(sorted_keys):
+                found &= sorted_keys[pos] == chunk_keys
+            else:
+                found[:] = False
+            positions.append(pos)
+        if not found.any():
+            continue
+        parts, seen = [], set()
+        for f, (_, rows), pos, cols in zip(files, indexes, positions,
+                                           file_columns):
+            cols = list(f.columns if cols is None else cols)
+            if not parts and on not in cols:
+                cols.insert(0, on)
+            cols = [x for x in cols if x not in seen]
+            seen.update(cols)
+            part = f.read(cols, rows=rows[pos[found]])
+            parts.append(part.reset_index(drop=True))
+        dat = pd.concat(parts, axis=1)
+        dat.index = pd.RangeIndex(row, row + len(dat))
+        row += len(dat)
+        yield dat
+
+
+def _dimension_table(spec, key, options):
+    '''
+    Read a small file to join onto read_hcup() chunks (e.g. the Hospital file
+    on HOSP_NIS), with caching. The table is kept in an in-memory LRU cache
+    keyed by the file's path, size, and modification time, its layout, and
+    the read options, and comes back with an index of its keys.
+    '''
+    if isinstance(spec, pd.DataFrame):
+        table = spec
+    else:
+        if isinstance(spec, str):
+            # HCUP ships each file's load script as SASLoad_<name>.SAS
+            name = os.path.splitext(os.path.basename(spec))[0]
+            sas_script = os.path.join(os.path.dirname(spec),
+                                      'SASLoad_' + name + '.SAS')
+            if not os.path.exists(sas_script):
+                raise ValueError('no SAS load file {} for {}; give the join '
+                                 'as (data_file, sas_script)'.format(
+                                     sas_script, spec))
+            spec = {'data_file': spec, 'sas_script': sas_script}
+        elif not isinstance(spec, dict):
+            spec = {'data_file': spec[0], 'sas_script': spec[1]}
+        kwargs = dict(options, **spec)
+        data_file, sas_script = kwargs.pop('data_file'), \
+            kwargs.pop('sas_script')
+        layout = sas_script if isinstance(sas_script, SasLayout) \
+            else get_layout(sas_script, kind='hcup')
+        stat = os.stat(data_file)
+        cache_key = (os.path.abspath(data_file), stat.st_size, stat.st_mtime,
+                     layout.digest, key, repr(sorted(kwargs.items())))
+        if cache_key in _dimensions:
+            _dimensions[cache_key] = _dimensions.pop(cache_key)
+            return _dimensions[cache_key]
+        table = read_hcup(data_file, layout, **kwargs)
+    index = pd.Index(np.asarray(table[key]))
+    if not index.is_unique:
+        raise ValueError('{} is not unique in the join table'.format(key))
+    if isinstance(spec, pd.DataFrame):
+        return table, index
+    _dimensions[cache_key] = table, index
+    while len(_dimensions) > _DIMENSION_CACHE_SIZE:
+        _dimensions.popitem(last=False)
+    return table, index
+
+
+def _attach_dimensions(chunks, dimensions):
+    '''
+    Generator adding the columns of each dimension table to every chunk. Each
+    chunk's key column is mapped to table rows through an integer position
+    map, built from the categories of a categorical key (and reused while the
+    categories stay the same) rather than merging row by row.
+    '''
+    maps = {}
+    for chunk in chunks:
+        columns = OrderedDict()
+        for key, (table, index) in dimensions.items():
+            x = chunk[key]
+            if isinstance(x.dtype, pd.CategoricalDtype):
+                cats = x.cat.categories
+                if key not in maps or not maps[key][0].equals(cats):
+                    maps[key] = cats, _category_lookup(cats, index)
+                rows = maps[key][1][x.cat.codes.values]
+            else:
+                rows = index.get_indexer(x.values)
+            for col in table.columns:
+                if col != key and col not in chunk.columns and \
+                        col not in columns:
+                    columns[col] = table[col].array.take(rows,
+                                                         allow_fill=True)
+        yield pd.concat([chunk, pd.DataFrame(columns, index=chunk.index)],
+                        axis=1)
 
 
 def read_hcup(data_file, sas_script, chunksize=500000, combine_chunks=True,
-              return_meta=False, strings_to_categorical=True, **kwargs):
+              return_meta=False, strings_to_categorical=True, engine='pandas',
+              columns=None, n_jobs=None, missing_reasons=False,
+              compact_dtypes=False, join=None, where=None, **kwargs):
     '''
     Arguments:
         data_file (str): Path of fixed-width text data file
-        sas_script (str): Path of the accompanying SAS load file
+        sas_script (str or SasLayout): Path of the accompanying SAS load file,
+            or its layout from get_layout()
         chunksize (int, default 500K): Break data into chunks of size chunksize
             and read/process each chunk separately (for lower memory usage)
         combine_chunks (bool, default True): Return single DataFrame with all
@@ -38,7 +1156,52 @@ def read_hcup(data_file, sas_script, chunksize=500000, combine_chunks=True,
             column metadata (True), or just return the processed data (False)
         strings_to_categorical (bool, default True): Convert variables defined
             as CHAR in SAS script to pd.Categorical upon import
-        kwargs: passed on to pandas.read_fwf()
+        engine (str, default 'pandas'): 'pandas' parses the file with
+            pandas.read_fwf(). 'numpy' reads the file as fixed-length byte
+            records of LRECL bytes and decodes each field in bulk with numpy,
+            which is much faster and gives identical results
+        columns (list, default None): Only read these fields, given as names,
+            regular expressions, or HCUP grouped-variable stems like "I10_DXn".
+            The byte ranges of all other fields are skipped entirely
+        n_jobs (int, default None): Parse chunks in a pool of this many
+            processes (-1 for one per CPU). Chunks are split at record
+            boundaries and returned in file order, so the result is the same
+            as reading serially
+        missing_reasons (bool, default False): For every field whose informat
+            has special missing values, add an int8 column '<name>_reason'
+            right after it: 0 if the value is present or plainly missing
+            ('.'), and 1-26 for the special missing values .A-.Z. In HCUP
+            files these are 1 (.A, invalid), 3 (.C, inconsistent), and 14
+            (.N, not applicable)
+        compact_dtypes (bool, default False): Give every field the smallest
+            dtype that exactly holds its values, based on its SAS informat
+            and width: nullable Int8/Int16/Int32/Int64 for integer fields,
+            float32 for decimal fields with at most 6 significant digits,
+            float64 for the rest, and categories only for CHAR fields. Use
+            misc.compare_memory() to see the bytes saved per column
+        join (dict, default None): Small "dimension" files to attach to every
+            record, keyed by the column to join on, e.g.
+            {'HOSP_NIS': 'NIS_2015_Hospital.ASC'}. Each file is given as its
+            path (if its SAS load file, SASLoad_<name>.SAS, is next to it), a
+            (data_file, sas_script) tuple, a dict of read_hcup() arguments, or
+            an already loaded DataFrame. Files are read once, with the same
+            engine and dtype options, and cached. Their columns (but the key,
+            and any already read) are added to each chunk through a position
+            map of the key's categories: a left join without a merge. The key
+            column must be among the columns read
+        where (str or list, default None): Only return the records that
+            match, either a pandas.eval() expression such as
+            "YEAR == 2015 and AGE >= 65", or a list of (column, op, value)
+            tuples that must all hold, as in read_converted(), e.g.
+            [('AGE', '>=', 65), ('DRG', 'in', [291, 292])]. Text fields are
+            compared as strings and all others as numbers, and the columns
+            needn't be among those returned. The numpy engine decodes just
+            these fields first and then the rest only for the matching
+            records; the pandas engine parses everything and filters after.
+            Either way, categoricals only get the categories of the matching
+            records
+        kwargs: passed on to pandas.read_fwf(). The numpy engine only accepts
+            nrows, keep_default_na, and encoding
 
     Returns:
         Default: a single pandas DataFrame
@@ -49,49 +1212,104 @@ def read_hcup(data_file, sas_script, chunksize=500000, combine_chunks=True,
     # what dtype to use for text columns
     text = 'category' if strings_to_categorical else 'object'
 
-    # read in the sas script
-    with open(sas_script) as f:
-        sas = f.readlines()
-
-    # grab the lines that define the fields. returns three match groups:
-    # 0 = starting position, 1 = field name, 2 = variable type
-    fields = [re.search(r'@\s*(\d+)\s+(\S+)\s+(\S+)\s?', x) for x in sas]
-    fields = [x.groups() for x in fields if x]
-
-    # from those, grab the names and starting positions, and infer the dtypes
-    starts = [int(x[0]) for x in fields]
-    names = [x[1] for x in fields]
+    # parse the sas script (or fetch it from the cache)
+    layout = sas_script if isinstance(sas_script, SasLayout) \
+        else get_layout(sas_script, kind='hcup')
+    names, starts, widths = layout.names, layout.starts, layout.widths
+    maxcols = layout.lrecl
 
     # use different dtypes based on whether user requests metadata or data.
     # in the latter case we just make everything a category for max compression
     # for numerics, must use floats since int columns can't have missing values
     # but it's okay because floats hardly use more space than ints
-    if return_meta:
-        dtype = [text if re.search(r'CHAR', x[2]) else float for x in fields]
+    if compact_dtypes:
+        dtype = [_compact_dtype(x, w)
+                 for x, w in zip(layout.informats, widths)]
+        dtype = [text if x == 'category' else x for x in dtype]
+    elif return_meta:
+        dtype = [text if re.search(r'CHAR', x) else float
+                 for x in layout.informats]
     else:
         # keep KEY_NIS as numeric so it can be safely sorted on
         dtype = [text if col != 'KEY_NIS' else float for col in names]
 
-    # convert dtype list into dictionary (for pd.read_fwf)
-    dtypes = dict(zip(names, dtypes))
-
-    # compute the variable widths
-    maxcols = int(re.search(r'LRECL = (.+);', ''.join(sas)).group(1))
-    widths = np.diff(starts + [maxcols+1])
+    # keep only the requested columns, and convert dtype list into dictionary
+    # (for pd.read_fwf)
+    keep = _select_columns(names, columns)
+    names = [names[i] for i in keep]
+    starts = [starts[i] for i in keep]
+    widths = np.array([widths[i] for i in keep], dtype=int)
+    dtype = {names[j]: dtype[i] for j, i in enumerate(keep)}
 
-    # grab all the missing value codes
-    na_vals = re.findall(r'\'(.+)\' = \S+', ''.join(sas))
-    na_vals += ['.']
+    # grab the missing value codes of each column's informat
+    na_vals = layout.field_na_values
+    na_vals = {name: na_vals[name] for name in names}
+    special = layout.special_missing if missing_reasons else {}
+    reasons = {name: special[name] for name in names if name in special}
 
     # return meta-data if requested
     if return_meta:
         return {'names': names, 'starts': starts, 'widths': widths,
-                'dtypes': dtype, 'na_values': na_vals}
+                'dtypes': dtype, 'na_values': na_vals, 'lrecl': maxcols}
 
     # get a generator that reads the data in chunks
-    dat = pd.read_fwf(data_file, header=None, names=names, widths=widths,
-                      dtype=dtype, na_values=na_vals, chunksize=chunksize,
-                      **kwargs)
+    if engine not in ('numpy', 'pandas'):
+        raise ValueError('engine must be "pandas" or "numpy", not '
+                         '"{}"'.format(engine))
+    colspecs = [(s-1, s-1+w) for s, w in zip(starts, widths)]
+    row_filter = extra = None
+    if where is not None:
+        row_filter = _RowFilter(where, layout, compact_dtypes)
+    if engine == 'pandas' and row_filter is not None:
+        # read the predicate's fields too, to drop them after filtering
+        extra = [x for x in row_filter.names if x not in names]
+        for name in extra:
+            i = row_filter.names.index(name)
+            names = names + [name]
+            colspecs = colspecs + [(row_filter.starts[i] - 1,
+                                    row_filter.starts[i] - 1 +
+                                    row_filter.widths[i])]
+            dtype[name] = row_filter.dtype[name]
+            na_vals[name] = row_filter.na_values[name]
+    if engine == 'pandas' and reasons:
+        # read the missing reasons as extra copies of their fields
+        for name in reasons:
+            i = names.index(name) + 1
+            names = names[:i] + [name + '_reason'] + names[i:]
+            colspecs = colspecs[:i] + [colspecs[i-1]] + colspecs[i:]
+        kwargs['converters'] = dict(
+            kwargs.get('converters', {}),
+            **{name + '_reason': _ReasonConverter(codes)
+               for name, codes in reasons.items()})
+    if n_jobs is not None and n_jobs != 1:
+        if engine == 'numpy':
+            kwargs.update(names=names, starts=starts, widths=widths,
+                          dtype=dtype, na_values=na_vals, lrecl=maxcols,
+                          reasons=reasons, where=row_filter)
+        else:
+            kwargs.update(header=None, names=names, colspecs=colspecs,
+                          dtype=dtype, na_values=na_vals)
+        dat = _read_parallel(data_file, chunksize, n_jobs, engine, kwargs)
+    elif engine == 'numpy':
+        dat = _read_fwf_numpy(data_file, names=names, starts=starts,
+                              widths=widths, dtype=dtype, na_values=na_vals,
+                              lrecl=maxcols, chunksize=chunksize,
+                              reasons=reasons, where=row_filter, **kwargs)
+    else:
+        dat = pd.read_fwf(data_file, header=None, names=names,
+                          colspecs=colspecs, dtype=dtype, na_values=na_vals,
+                          chunksize=chunksize, **kwargs)
+    if engine == 'pandas' and reasons:
+        dat = _astype_chunks(dat, {name + '_reason': np.int8
+                                   for name in reasons})
+    if engine == 'pandas' and row_filter is not None:
+        dat = _filter_chunks(dat, row_filter, extra)
+    if join:
+        options = {'engine': engine, 'compact_dtypes': compact_dtypes,
+                   'strings_to_categorical': strings_to_categorical}
+        dat = _attach_dimensions(dat, OrderedDict(
+            (key, _dimension_table(spec, key, options))
+            for key, spec in join.items()))
 
     # return generator if requested
     if not combine_chunks:
@@ -107,12 +1325,251 @@ def read_hcup(data_file, sas_script, chunksize=500000, combine_chunks=True,
     return dat
 
 
+def iter_hcup(data_file, sas_script, transforms=None, reduce=None,
+              initial=None, engine='numpy', compact_dtypes=True, **kwargs):
+    '''
+    Stream an HCUP file as typed, NA-cleaned chunks, with only one chunk in
+    memory at a time. Usage:
+    ```
+    old = lambda d: d['AGE'] >= 65
+    los_days = lambda d: d.assign(LOS_WEEKS=d['LOS'] / 7)
+    for chunk in iter_hcup(data_file, sas_script, [old, los_days]):
+        ...
+    totals = iter_hcup(data_file, sas_script, [old],
+                       reduce=group_totals('DQTR', ['DIED', 'LOS']))
+    ```
+
+    Arguments:
+        data_file (str): Path of fixed-width text data file
+        sas_script (str or SasLayout): Path of the accompanying SAS load file,
+            or its layout from get_layout()
+        transforms (list of callables, default None): Applied in order to
+            each chunk. A transform that returns a DataFrame replaces the
+            chunk (e.g., to add derived columns); one that returns a boolean
+            Series or array filters the chunk's rows. Chunks left with no rows
+            are skipped
+        reduce (callable, default None): Streaming aggregation, called as
+            state = reduce(state, chunk) for every chunk (see group_totals)
+        initial (default None): Starting state for reduce
+        engine, compact_dtypes: as in read_hcup(), but with the faster and
+            more compact options as the defaults
+        kwargs: passed on to read_hcup(), e.g. chunksize, columns, n_jobs
+
+    Returns:
+        Default: Generator of pandas DataFrames
+        If reduce is given: the final state
+    '''
+    chunks = read_hcup(data_file, sas_script, combine_chunks=False,
+                       engine=engine, compact_dtypes=compact_dtypes, **kwargs)
+    chunks = _transform_chunks(chunks, transforms or [])
+    if reduce is None:
+        return chunks
+    state = initial
+    for chunk in chunks:
+        state = reduce(state, chunk)
+    return state
+
+
+def _transform_chunks(chunks, transforms):
+    '''Generator applying iter_hcup() transforms/filters to each chunk.'''
+    for chunk in chunks:
+        for transform in transforms:
+            result = transform(chunk)
+            if isinstance(result, pd.DataFrame):
+                chunk = result
+            else:
+                # rows where a nullable comparison is missing don't match
+                chunk = chunk[pd.Series(result, dtype='boolean')
+                              .fillna(False).to_numpy(dtype=bool)]
+        if len(chunk):
+            yield chunk
+
+
+def group_totals(by=None, columns=None):
+    '''
+    Reducer for iter_hcup(..., reduce=...) that accumulates the non-missing
+    count and the sum of numeric columns, optionally within groups, in
+    constant memory. Means are then state['sum'] / state['count'].
+
+    Arguments:
+        by (str or list, default None): Column(s) to group by
+        columns (list, default None): Columns to total (default all numeric)
+
+    Returns:
+        A function reduce(state, chunk) -> state, where state is a DataFrame
+        with a ('count' | 'sum', column) MultiIndex on the columns
+    '''
+    def reduce(state, chunk):
+        cols = columns
+        if cols is None:
+            keys = [] if by is None else \
+                [by] if isinstance(by, str) else list(by)
+            cols = [x for x in chunk.select_dtypes('number').columns
+                    if x not in keys]
+        dat = chunk[cols].astype('float64')
+        if by is None:
+            totals = pd.concat({'count': dat.count().to_frame('all').T,
+                                'sum': dat.sum().to_frame('all').T}, axis=1)
+        else:
+            groups = dat.groupby([chunk[x] for x in (
+                [by] if isinstance(by, str) else by)], observed=True)
+            totals = pd.concat({'count': groups.count(),
+                                'sum': groups.sum()}, axis=1)
+        return totals if state is None else state.add(totals, fill_value=0)
+    return reduce
+
+
+def _common_dtype(dtypes):
+    '''
+    One dtype that holds the values of every file's dtype for a column, for
+    stacking files whose layouts disagree: categories if any file has them,
+    then object, then the widest numeric type (nullable if any of them is).
+    '''
+    dtypes = [x if x == 'category' else pd.api.types.pandas_dtype(x)
+              for x in dtypes]
+    if any(x == 'category' for x in dtypes):
+        return 'category'
+    if any(pd.api.types.is_object_dtype(x) for x in dtypes):
+        return np.dtype(object)
+    common = np.result_type(*[getattr(x, 'numpy_dtype', x) for x in dtypes])
+    nullable = any(isinstance(x, pd.api.extensions.ExtensionDtype)
+                   for x in dtypes)
+    if common.kind in 'iu' and nullable:
+        return pd.api.types.pandas_dtype('{}{}'.format(
+            'Int' if common.kind == 'i' else 'UInt', common.itemsize * 8))
+    return common
+
+
+def _data_meta(data_file, layout, kwargs):
+    '''
+    Names and dtypes of the columns read_hcup(data_file, layout, **kwargs)
+    returns, from its return_meta=True metadata, without reading any data.
+    '''
+    meta = read_hcup(data_file, layout, return_meta=True, **kwargs)
+    names, dtypes = list(meta['names']), dict(meta['dtypes'])
+    if not kwargs.get('compact_dtypes'):
+        # as in read_hcup(), everything but KEY_NIS is read as text
+        text = 'category' if kwargs.get('strings_to_categorical', True) \
+            else 'object'
+        dtypes = {name: float if name == 'KEY_NIS' else text for name in names}
+    if kwargs.get('missing_reasons'):
+        for name in [x for x in names if x in layout.special_missing]:
+            names.insert(names.index(name) + 1, name + '_reason')
+            dtypes[name + '_reason'] = np.int8
+    return names, dtypes
+
+
+def _project_chunk(chunk, names, dtypes, index):
+    '''
+    Put a chunk into the unified schema of read_hcup_many(): every column in
+    the same order and with the same dtype, adding the columns the chunk's
+    file doesn't have as missing values.
+    '''
+    columns = OrderedDict()
+    for name in names:
+        dtype = dtypes[name]
+        if name in chunk.columns:
+            x = chunk[name]
+            columns[name] = (x if x.dtype == dtype else x.astype(dtype)).values
+        elif dtype == 'category':
+            columns[name] = pd.Categorical.from_codes(
+                np.full(len(index), -1, dtype=np.int8),
+                categories=pd.Index([], dtype=str))
+        elif isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+            # only the missing reasons are plain ints, and 0 is "not missing"
+            columns[name] = np.zeros(len(index), dtype=dtype)
+        else:
+            columns[name] = pd.array(np.full(len(index), np.nan), dtype=dtype)
+    return pd.DataFrame(columns, columns=names, index=index)
+
+
+def _iter_many(files, names, dtypes):
+    '''Generator of the projected chunks of read_hcup_many().'''
+    row = 0
+    for data_file, layout, kwargs in files:
+        for chunk in read_hcup(data_file, layout, combine_chunks=False,
+                               **kwargs):
+            index = pd.RangeIndex(row, row + len(chunk))
+            yield _project_chunk(chunk, names, dtypes, index)
+            row += len(chunk)
+
+
+def read_hcup_many(specs, output=None, format='parquet', partition_cols=None,
+                   engine='numpy', compact_dtypes=True, **kwargs):
+    '''
+    Read several HCUP files whose layouts differ (e.g., the ICD-9 Q1Q3 and
+    ICD-10 Q4 DX_PR_GRPS or Severity files of NIS 2015) as one stream of
+    chunks with a single, unified schema, one chunk in memory at a time. The
+    schema is worked out up front from each file's read_hcup(...,
+    return_meta=True) metadata: the union of the columns, in the order they
+    first appear, with one dtype per column that holds every file's values.
+    Each chunk then gets every column, with the ones its file lacks filled
+    with missing values, so the chunks can be stacked with stack_chunks() or
+    written to one dataset. Usage:
+    ```
+    specs = [('NIS_2015Q1Q3_Severity.ASC',
+              'SASLoad_NIS_2015Q1Q3_Severity.SAS'),
+             ('NIS_2015Q4_Severity.ASC', 'SASLoad_NIS_2015Q4_Severity.SAS')]
+    for chunk in read_hcup_many(specs):
+        ...
+    read_hcup_many(specs, output='severity_2015')
+    dat = read_converted('severity_2015')
+    ```
+
+    Arguments:
+        specs (list): The files, in order, as (data_file, sas_script) tuples
+            or as dicts of read_hcup() arguments with at least data_file and
+            sas_script, which override kwargs for that file
+        output (str, default None): Write the chunks to a dataset in this
+            directory, as convert() does, instead of returning them
+        format (str, default 'parquet'): 'parquet' or 'feather', if output is
+            given
+        partition_cols (list, default None): Columns to partition the dataset
+            by, if output is given
+        engine, compact_dtypes: as in read_hcup(), but with the faster and
+            more compact options as the defaults
+        kwargs: passed on to read_hcup(), e.g. chunksize, columns, n_jobs
+
+    Returns:
+        Default: Generator of pandas DataFrames. The row index runs on across
+            files, and chunks never span two files
+        If output is given: the path of the dataset, whose metadata holds the
+            list of the files' SasLayouts
+    '''
+    kwargs.update(engine=engine, compact_dtypes=compact_dtypes)
+    files, names, dtypes = [], [], {}
+    for spec in specs:
+        spec = dict(spec) if isinstance(spec, dict) else \
+            {'data_file': spec[0], 'sas_script': spec[1]}
+        data_file, sas_script = spec.pop('data_file'), spec.pop('sas_script')
+        layout = sas_script if isinstance(sas_script, SasLayout) \
+            else get_layout(sas_script, kind='hcup')
+        file_kwargs = dict(kwargs, **spec)
+        files.append((data_file, layout, file_kwargs))
+        file_names, file_dtypes = _data_meta(data_file, layout, file_kwargs)
+        for name in file_names:
+            if name not in dtypes:
+                names.append(name)
+                dtypes[name] = []
+            dtypes[name].append(file_dtypes[name])
+    dtypes = {name: _common_dtype(x) for name, x in dtypes.items()}
+
+    chunks = _iter_many(files, names, dtypes)
+    if output is None:
+        return chunks
+    pa = _import_pyarrow()
+    return _write_dataset(pa, chunks, output, format,
+                          [layout for _, layout, _ in files], partition_cols)
+
+
 def read_mhos(sas_script, data_file=None, chunksize=500000, combine_chunks=True,
-              return_meta=False, strings_to_categorical=True, **kwargs):
+              return_meta=False, strings_to_categorical=True, columns=None,
+              n_jobs=None, **kwargs):
     '''
     Arguments:
         data_file (str): Path of fixed-width text data file
-        sas_script (str): Path of the accompanying SAS load file
+        sas_script (str or SasLayout): Path of the accompanying SAS load file,
+            or its layout from get_layout()
         chunksize (int, default 500K): Break data into chunks of size chunksize
             and read/process each chunk separately (for lower memory usage)
         combine_chunks (bool, default True): Return single DataFrame with all
@@ -121,6 +1578,13 @@ def read_mhos(sas_script, data_file=None, chunksize=500000, combine_chunks=True,
             column metadata (True), or just return the processed data (False)
         strings_to_categorical (bool, default True): Convert variables defined
             as CHAR in SAS script to pd.Categorical upon import
+        columns (list, default None): Only read these fields, given as names
+            or regular expressions. The byte ranges of all other fields are
+            skipped entirely
+        n_jobs (int, default None): Parse chunks in a pool of this many
+            processes (-1 for one per CPU). Chunks are split at line
+            boundaries and returned in file order, so the result is the same
+            as reading serially
         kwargs: passed on to pandas.read_fwf()
 
     Returns:
@@ -135,35 +1599,17 @@ def read_mhos(sas_script, data_file=None, chunksize=500000, combine_chunks=True,
     # what dtype to use for text columns
     text = 'category' if strings_to_categorical else 'object'
 
-    # read in the sas script
-    with open(sas_script) as f:
-        sas = f.readlines()
-
-    # match groups (indexed from 1, not 0)
-    # 1 = prefix, 2 = field name, 3 = string, 4 = start position,
-    # 5 = end position, 6 = field number, 7 = field description
-    regex = r'^\s+(&[c|C].|&[r|R].|&[p|P].)?(\S+)\s+(\$)?\s*(\d{1,3})-?(\d{1,3})?\S*\s*/\*\s+(\d{1,3})(.*)\*/'
-    fields = [re.search(regex, x) for x in sas if re.search(regex, x)]
-
-    # check that we matched all and only the the right field numbers
-    assert [int(x.group(6)) for x in fields if x] \
-        == list(range(1, len(fields)+1))
-
-    # extract the meta-data
-    prefix = [x.group(1) for x in fields]
-    names = [x.group(2).lower() for x in fields]
-    dtypes = [str if x.group(2)=='CASE_ID' else text if x.group(3) else float
-              for x in fields]
-    starts = [int(x.group(4))-1 for x in fields]
-    ends = [int(x.group(5)) if x.group(5) else int(x.group(4)) for x in fields]
-    descriptions = [x.group(7).strip() for x in fields]
-
-    # handle duplicate names
-    vc = pd.Series(names).value_counts()
-    dupes = list(vc.index[vc > 1])
-    dupes = [x in dupes for x in names]
-    names = [prefix+name if dupe else name
-             for prefix, name, dupe in zip(prefix, names, dupes)]
+    # parse the sas script (or fetch it from the cache)
+    layout = sas_script if isinstance(sas_script, SasLayout) \
+        else get_layout(sas_script, kind='mhos')
+    keep = _select_columns(layout.names, columns)
+    names = [layout.names[i] for i in keep]
+    dtypes = [str if name == 'case_id' else
+              text if layout.informats[i] else float
+              for name, i in zip(names, keep)]
+    starts = [layout.starts[i]-1 for i in keep]
+    ends = [layout.starts[i]-1+layout.widths[i] for i in keep]
+    descriptions = [layout.labels[i] for i in keep]
 
     # convert dtype list into dictionary (for pd.read_fwf)
     dtypes = dict(zip(names, dtypes))
@@ -174,9 +1620,14 @@ def read_mhos(sas_script, data_file=None, chunksize=500000, combine_chunks=True,
                 'dtypes': dtypes, 'descriptions': descriptions}
 
     # get a generator that reads the data in chunks
-    dat = pd.read_fwf(data_file, header=None, names=names,
-                      colspecs=list(zip(starts, ends)), dtype=dtypes,
-                      chunksize=chunksize, **kwargs)
+    if n_jobs is not None and n_jobs != 1:
+        kwargs.update(header=None, names=names,
+                      colspecs=list(zip(starts, ends)), dtype=dtypes)
+        dat = _read_parallel(data_file, chunksize, n_jobs, 'pandas', kwargs)
+    else:
+        dat = pd.read_fwf(data_file, header=None, names=names,
+                          colspecs=list(zip(starts, ends)), dtype=dtypes,
+                          chunksize=chunksize, **kwargs)
 
     # return generator if requested
     if not combine_chunks:
@@ -190,3 +1641,187 @@ def read_mhos(sas_script, data_file=None, chunksize=500000, combine_chunks=True,
         dat = dat[0]
 
     return dat
+
+
+def _import_pyarrow():
+    '''Import pyarrow, which is only needed for convert()/read_converted().'''
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('convert() and read_converted() require pyarrow: '
+                          'pip install pyarrow')
+    return pyarrow
+
+
+def _arrow_schemas(pa, chunk, layout, partition_cols):
+    '''
+    Arrow schema for every chunk of a converted file, based on the first one,
+    plus the schema of the partition columns. Categoricals always get int32
+    indices and string values, whatever the categories of the first chunk,
+    and the SAS layout (or list of layouts, for read_hcup_many()) and
+    partitioning are stored in the schema metadata.
+    '''
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, name in enumerate(schema.names):
+        if isinstance(chunk[name].dtype, pd.CategoricalDtype) or \
+                schema.field(name).type == pa.null():
+            schema = schema.set(i, pa.field(
+                name, pa.dictionary(pa.int32(), pa.string())))
+    # directory names can't hold dictionaries, so use their values instead
+    partitioning = pa.schema([
+        pa.field(x, pa.string())
+        if pa.types.is_dictionary(schema.field(x).type) else schema.field(x)
+        for x in partition_cols])
+    metadata = dict(schema.metadata or {})
+    layout = layout.to_dict() if isinstance(layout, SasLayout) \
+        else [x.to_dict() for x in layout]
+    metadata[b'jwpy_sas_layout'] = json.dumps(layout).encode()
+    metadata[b'jwpy_partitioning'] = partitioning.serialize().to_pybytes()
+    return schema.with_metadata(metadata), partitioning
+
+
+def convert(data_file, sas_script, output, format='parquet',
+            partition_cols=None, kind='hcup', chunksize=500000, **kwargs):
+    '''
+    One-time conversion of an HCUP or MHOS fixed-width file to a columnar
+    Parquet or Feather (Arrow IPC) dataset, which read_converted() loads far
+    faster than re-parsing the text. The file is streamed through read_hcup()
+    or read_mhos() one chunk at a time, so memory use is bounded by chunksize.
+    Categorical columns are stored dictionary-encoded, and the SAS layout is
+    stored in the file metadata.
+
+    Arguments:
+        data_file (str): Path of fixed-width text data file
+        sas_script (str): Path of the accompanying SAS load file
+        output (str): Directory to write the dataset to
+        format (str, default 'parquet'): 'parquet' or 'feather'
+        partition_cols (list, default None): Columns to partition the dataset
+            by (e.g., ['YEAR', 'DQTR']), as hive-style subdirectories
+        kind (str, default 'hcup'): 'hcup' or 'mhos', the style of the script
+        chunksize (int, default 500K): Records converted at a time
+        kwargs: passed on to read_hcup() or read_mhos(), e.g. columns, engine,
+            compact_dtypes
+
+    Returns:
+        The path of the dataset
+    '''
+    pa = _import_pyarrow()
+    layout = get_layout(sas_script, kind=kind)
+    if kind == 'hcup':
+        chunks = read_hcup(data_file, layout, chunksize=chunksize,
+                           combine_chunks=False, **kwargs)
+    else:
+        chunks = read_mhos(layout, data_file, chunksize=chunksize,
+                           combine_chunks=False, **kwargs)
+    return _write_dataset(pa, chunks, output, format, layout, partition_cols)
+
+
+def _write_dataset(pa, chunks, output, format, layout, partition_cols):
+    '''Write the chunks of convert() or read_hcup_many() to a dataset.'''
+    if format not in ('parquet', 'feather'):
+        raise ValueError('format must be "parquet" or "feather", not '
+                         '"{}"'.format(format))
+    if os.path.isdir(output) and os.listdir(output):
+        raise ValueError('{} already exists and is not empty'.format(output))
+
+    # the schema comes from the first chunk
+    chunks = iter(chunks)
+    first = next(chunks)
+    schema, partitioning = _arrow_schemas(pa, first, layout,
+                                          list(partition_cols or []))
+
+    # each chunk goes to its own files, since arrow IPC files only allow one
+    # dictionary per categorical column
+    for i, chunk in enumerate(chain([first], chunks)):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        pa.dataset.write_dataset(
+            table.cast(schema), output,
+            format='parquet' if format == 'parquet' else 'ipc',
+            partitioning=pa.dataset.partitioning(partitioning, flavor='hive')
+            if partition_cols else None,
+            basename_template='part-{}-{{i}}.{}'.format(i, format),
+            existing_data_behavior='overwrite_or_ignore')
+    return output
+
+
+def read_converted(path, columns=None, filters=None, format='parquet',
+                   return_meta=False):
+    '''
+    Load a dataset written by convert().
+
+    Arguments:
+        path (str): Directory the dataset was written to
+        columns (list, default None): Only load these columns
+        filters (list, default None): Row filters as (column, op, value)
+            tuples, in the style of pyarrow.parquet.read_table(), e.g.
+            [('YEAR', '==', 2015), ('DQTR', 'in', [1, 2])]. Filters on
+            partition columns skip the other partitions' files entirely
+        format (str, default 'parquet'): 'parquet' or 'feather'
+        return_meta (bool, default False): Return the SasLayout of the source
+            file *instead of* the data
+
+    Returns:
+        Default: a single pandas DataFrame. Rows are grouped by partition, so
+            they are only in file order if the dataset is not partitioned
+        If return_meta=True: the SasLayout stored with the dataset, or a list
+            of them for a dataset written by read_hcup_many()
+    '''
+    pa = _import_pyarrow()
+    fmt = 'parquet' if format == 'parquet' else 'ipc'
+    metadata = pa.dataset.dataset(path, format=fmt).schema.metadata
+    if return_meta:
+        layout = json.loads(metadata[b'jwpy_sas_layout'].decode())
+        if isinstance(layout, list):
+            return [SasLayout.from_dict(x) for x in layout]
+        return SasLayout.from_dict(layout)
+
+    partitioning = pa.ipc.read_schema(
+        pa.py_buffer(metadata[b'jwpy_partitioning']))
+    dat = pa.dataset.dataset(
+        path, format=fmt, partitioning=pa.dataset.partitioning(
+            partitioning, flavor='hive') if len(partitioning) else None)
+    table = dat.to_table(
+        columns=columns,
+        filter=pa.parquet.filters_to_expression(filters) if filters else None)
+    dat = table.replace_schema_metadata(metadata).to_pandas()
+
+    # restore the column order and the partition columns' categories
+    order = [x['name'] for x in json.loads(metadata[b'pandas'])['columns']]
+    dat = dat[[x for x in order if x in dat.columns]]
+    for x in partitioning.names:
+        if x in dat.columns and pa.types.is_string(partitioning.field(x).type):
+            dat[x] = dat[x].astype('category')
+    return dat
+
+
+def convert_main(argv=None):
+    '''Command line entry point for convert() (the jwpy-convert script).'''
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert an HCUP or MHOS fixed-width file to a '
+                    'partitioned Parquet or Feather dataset.')
+    parser.add_argument('data_file', help='fixed-width text data file')
+    parser.add_argument('sas_script', help='accompanying SAS load file')
+    parser.add_argument('output', help='directory to write the dataset to')
+    parser.add_argument('--format', default='parquet',
+                        choices=['parquet', 'feather'])
+    parser.add_argument('--partition-cols', nargs='+', default=None,
+                        help='columns to partition the dataset by')
+    parser.add_argument('--kind', default='hcup', choices=['hcup', 'mhos'])
+    parser.add_argument('--chunksize', type=int, default=500000)
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help='only convert these fields')
+    parser.add_argument('--engine', default='pandas',
+                        choices=['pandas', 'numpy'],
+                        help='parser to use (HCUP files only)')
+    parser.add_argument('--compact-dtypes', action='store_true',
+                        help='store the smallest exact dtypes (HCUP only)')
+    args = parser.parse_args(argv)
+    kwargs = {'columns': args.columns}
+    if args.kind == 'hcup':
+        kwargs.update(engine=args.engine, compact_dtypes=args.compact_dtypes)
+    convert(args.data_file, args.sas_script, args.output, format=args.format,
+            partition_cols=args.partition_cols, kind=args.kind,
+            chunksize=args.chunksize, **kwargs)
@@ -36,6 +36,12 @@ setup(
     packages=find_packages(include=['jwpy']),
     include_package_data=True,
     install_requires=requirements,
+    extras_require={'arrow': ['pyarrow']},
+    entry_points={
+        'console_scripts': [
+            'jwpy-convert=jwpy.sas_fwf:convert_main',
+        ],
+    },
     license="MIT license",
     zip_safe=False,
     keywords='jwpy',
@@ -3,10 +3,40 @@
 
 """Tests for `jwpy` package."""
 
+import os
+import shutil
 import pytest
+import numpy as np
+import pandas as pd
+import scipy.stats
+import matplotlib.pyplot as plt
 
-from jwpy.explore_funcs import summarize_df
-from jwpy.sas_fwf import head_hcup
+from jwpy.misc import compare_memory, align_frames, align_cols
+from jwpy import betabinom as betabinom_mod
+from jwpy.betabinom import betabinom, fit_many
+from jwpy.explore_funcs import summarize_df, shrink, shrink_counts, aov_xtab, \
+    shrink_1d, CrossTabStats, SummaryState
+from jwpy import sas_fwf
+from jwpy.sas_fwf import read_hcup, FixedWidthFile, SasLayout, get_layout, \
+    convert_main, read_converted, iter_hcup, group_totals, read_hcup_many, \
+    join_hcup
+
+fwf_test = os.path.join(os.path.dirname(__file__), 'fwf_test')
+hcup_files = ['NIS_2015_Core', 'NIS_2015_Hospital', 'NIS_2015Q1Q3_DX_PR_GRPS',
+              'NIS_2015Q4_DX_PR_GRPS', 'NIS_2015Q1Q3_Severity',
+              'NIS_2015Q4_Severity']
+
+
+@pytest.fixture(autouse=True)
+def layout_cache(tmpdir, monkeypatch):
+    """Keep the on-disk SAS layout cache out of the home directory."""
+    monkeypatch.setenv('JWPY_CACHE_DIR', str(tmpdir))
+    return tmpdir
+
+
+def hcup_paths(f):
+    return {'data_file': os.path.join(fwf_test, f + '.fwf'),
+            'sas_script': os.path.join(fwf_test, 'SASLoad_' + f + '.SAS')}
 
 
 @pytest.fixture
@@ -25,10 +55,654 @@ def test_content(response):
     # assert 'GitHub' in BeautifulSoup(response.content).title.string
 
 def test_read_hcup():
-    files = ['NIS_2015_Core', 'NIS_2015_Hospital', 'NIS_2015Q1Q3_DX_PR_GRPS',
-             'NIS_2015Q4_DX_PR_GRPS', 'NIS_2015Q1Q3_Severity',
-             'NIS_2015Q4_Severity']
-    datasets = [read_hcup(data_file='./fwf_test/'+f+'.fwf',
-                          sas_script='./fwf_test/SASLoad_'+f+'.SAS',
-                          chunksize=10) for f in files]
+    datasets = [read_hcup(chunksize=10, **hcup_paths(f)) for f in hcup_files]
     summarize_df(datasets[4])
+
+
+@pytest.mark.parametrize('f', hcup_files)
+def test_read_hcup_numpy_engine(f):
+    expected = read_hcup(**hcup_paths(f))
+    result = read_hcup(engine='numpy', **hcup_paths(f))
+    pd.testing.assert_frame_equal(result, expected)
+    # chunked reads have to line up too, including the row index
+    expected = read_hcup(chunksize=7, **hcup_paths(f))
+    result = read_hcup(engine='numpy', chunksize=7, **hcup_paths(f))
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('kwargs', [{'strings_to_categorical': False},
+                                    {'keep_default_na': False},
+                                    {'keep_default_na': False,
+                                     'compact_dtypes': True}])
+@pytest.mark.parametrize('n_jobs', [None, 2])
+def test_read_hcup_numpy_engine_options(tmpdir, kwargs, n_jobs):
+    for f in ['NIS_2015_Core', 'NIS_2015Q4_DX_PR_GRPS']:
+        paths = hcup_paths(f)
+        # pandas skips the blank lines at the end of a file
+        paths['data_file'] = shutil.copy(paths['data_file'], str(tmpdir))
+        with open(paths['data_file'], 'ab') as out:
+            out.write(b'\n\n')
+        expected = read_hcup(n_jobs=n_jobs, **dict(paths, **kwargs))
+        result = read_hcup(engine='numpy', n_jobs=n_jobs,
+                           **dict(paths, **kwargs))
+        pd.testing.assert_frame_equal(result, expected)
+        assert len(result) == 50
+
+
+def test_stack_chunks():
+    paths = hcup_paths('NIS_2015_Core')
+    expected = read_hcup(**paths)
+    chunks = list(read_hcup(chunksize=7, combine_chunks=False, **paths))
+    before = [c.copy() for c in chunks]
+    result = sas_fwf.stack_chunks(chunks)
+    # categories come out sorted, the same as a single read
+    pd.testing.assert_frame_equal(result, expected)
+    for chunk, copy in zip(chunks, before):
+        pd.testing.assert_frame_equal(chunk, copy)
+    # the order of the chunks doesn't change the categories
+    result = sas_fwf.stack_chunks(chunks[::-1])
+    assert result['HOSP_DIVISION'].cat.categories.equals(
+        expected['HOSP_DIVISION'].cat.categories)
+    # text columns stay object when the file spans several chunks
+    for engine in ['pandas', 'numpy']:
+        expected = read_hcup(strings_to_categorical=False, engine=engine,
+                             **paths)
+        result = read_hcup(strings_to_categorical=False, engine=engine,
+                           chunksize=7, **paths)
+        assert (expected.dtypes == object).any()
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_fixed_width_file():
+    paths = hcup_paths('NIS_2015Q4_DX_PR_GRPS')
+    meta = read_hcup(return_meta=True, **paths)
+    expected = pd.read_fwf(paths['data_file'], header=None,
+                           names=meta['names'], widths=meta['widths'],
+                           dtype=meta['dtypes'], na_values=meta['na_values'])
+    cols = ['DRG', 'I10_DX1', 'I10_NDX', 'KEY_NIS']
+    with FixedWidthFile(paths['data_file'], meta) as f:
+        assert len(f) == len(expected)
+        pd.testing.assert_frame_equal(f[cols], expected[cols])
+        pd.testing.assert_series_equal(f['I10_DX1'], expected['I10_DX1'])
+        pd.testing.assert_frame_equal(f.read(cols, rows=[3, 1, 40]),
+                                      expected[cols].iloc[[3, 1, 40]],
+                                      check_categorical=False)
+
+
+def test_key_index_lookup_join(tmpdir):
+    # the sidecar indexes go next to the data files, so work on copies
+    names = ['NIS_2015_Core', 'NIS_2015Q1Q3_Severity', 'NIS_2015Q4_Severity']
+    paths = {}
+    for name in names:
+        paths[name] = hcup_paths(name)
+        paths[name]['data_file'] = shutil.copy(paths[name]['data_file'],
+                                               str(tmpdir))
+    core = read_hcup(**paths['NIS_2015_Core'])
+    meta = read_hcup(return_meta=True, **paths['NIS_2015_Core'])
+    keys = core['KEY_NIS'].iloc[[30, 2, 17]].astype(float).tolist()
+    cols = ['KEY_NIS', 'AGE', 'LOS']
+    with FixedWidthFile(paths['NIS_2015_Core']['data_file'], meta) as f:
+        result = f.lookup(keys + [1.], columns=cols)
+        expected = f.read(cols, rows=[30, 2, 17])
+        pd.testing.assert_frame_equal(result, expected)
+        sidecar = f.data_file + '.KEY_NIS.idx.npz'
+        assert os.path.exists(sidecar)
+    # the sidecar is reused, and rebuilt once it goes stale
+    with FixedWidthFile(paths['NIS_2015_Core']['data_file'], meta) as f:
+        f._key_indexes = {}
+        pd.testing.assert_frame_equal(f.lookup(keys, columns=cols), expected)
+    np.savez(sidecar, keys=np.array([1.]), rows=np.array([0]),
+             stamp=np.array([0, 0]))
+    with FixedWidthFile(paths['NIS_2015_Core']['data_file'], meta) as f:
+        pd.testing.assert_frame_equal(f.lookup(keys, columns=cols), expected)
+
+    # joining Core with both Severity files agrees with pandas.merge
+    specs = [(x['data_file'], x['sas_script']) for x in paths.values()]
+    frames = [FixedWidthFile(*x).read() for x in specs]
+    for sev in (specs[1], specs[2]):
+        result = pd.concat(join_hcup([specs[0], sev], chunksize=7))
+        other = FixedWidthFile(*sev).read()
+        expected = frames[0].merge(
+            other[[x for x in other.columns
+                   if x not in frames[0].columns or x == 'KEY_NIS']],
+            on='KEY_NIS').sort_values('KEY_NIS').reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected,
+                                      check_categorical=False)
+    # a subset of keys, and columns per file
+    result = pd.concat(join_hcup(
+        [dict(data_file=specs[0][0], meta=specs[0][1], columns=['AGE']),
+         dict(data_file=specs[1][0], meta=specs[1][1],
+              columns=['APRDRG'])], keys=keys + [1.]))
+    assert list(result.columns) == ['KEY_NIS', 'AGE', 'APRDRG']
+    assert result['KEY_NIS'].tolist() == sorted(
+        x for x in keys if x in set(frames[1]['KEY_NIS']))
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_read_hcup_join(engine, monkeypatch):
+    core, hosp = hcup_paths('NIS_2015_Core'), hcup_paths('NIS_2015_Hospital')
+    monkeypatch.setattr(sas_fwf, '_dimensions', type(sas_fwf._dimensions)())
+    for compact_dtypes in (False, True):
+        kwargs = dict(engine=engine, compact_dtypes=compact_dtypes)
+        dat = read_hcup(**dict(core, **kwargs))
+        table = read_hcup(**dict(hosp, **kwargs))
+        expected = dat.merge(
+            table[[x for x in table.columns
+                   if x not in dat.columns or x == 'HOSP_NIS']],
+            on='HOSP_NIS', how='left')
+        # merge() loses the key's categories
+        expected['HOSP_NIS'] = dat['HOSP_NIS']
+        join = {'HOSP_NIS': hosp['data_file']}
+        result = read_hcup(chunksize=7, join=join, **dict(core, **kwargs))
+        pd.testing.assert_frame_equal(result, expected)
+    # the hospital file was parsed once per set of options
+    assert len(sas_fwf._dimensions) == 2
+    cached = list(sas_fwf._dimensions.values())[-1]
+    read_hcup(join={'HOSP_NIS': (hosp['data_file'], hosp['sas_script'])},
+              **dict(core, **kwargs))
+    assert list(sas_fwf._dimensions.values())[-1] is cached
+    # keys that aren't in the table get missing values
+    table = table[table['HOSP_NIS'] != 10001]
+    result = read_hcup(join={'HOSP_NIS': table}, **dict(core, **kwargs))
+    assert result['HOSP_BEDSIZE'].isnull().all()
+    with pytest.raises(ValueError):
+        read_hcup(join={'HOSP_NIS': pd.concat([table, table])}, **core)
+
+
+def _recategorize(df):
+    '''df with categories rebuilt from the values, as a read of its rows.'''
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object).astype('category')
+    return df
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+@pytest.mark.parametrize('n_jobs', [None, 2])
+def test_read_hcup_where(engine, n_jobs):
+    paths = hcup_paths('NIS_2015_Core')
+    full = read_hcup(compact_dtypes=True, **paths)
+    mask = ((full['AGE'] >= 65) & (full['FEMALE'] == 1)).fillna(False)
+    kwargs = dict(engine=engine, n_jobs=n_jobs, chunksize=7)
+    for compact_dtypes in (False, True):
+        expected = read_hcup(compact_dtypes=compact_dtypes, **paths)
+        expected = _recategorize(expected[mask.values])
+        for where in ['AGE >= 65 and FEMALE == 1',
+                      [('AGE', '>=', 65), ('FEMALE', 'in', [1])]]:
+            result = read_hcup(compact_dtypes=compact_dtypes, where=where,
+                               **dict(paths, **kwargs))
+            pd.testing.assert_frame_equal(result, expected)
+            # the predicate's columns needn't be returned
+            result = read_hcup(compact_dtypes=compact_dtypes, where=where,
+                               columns=['DQTR', 'LOS'],
+                               **dict(paths, **kwargs))
+            pd.testing.assert_frame_equal(result, expected[['DQTR', 'LOS']])
+    # text fields are compared as strings
+    paths = hcup_paths('NIS_2015Q4_DX_PR_GRPS')
+    full = read_hcup(**paths)
+    codes = full['I10_DX1'].dropna().unique()[:3].tolist()
+    result = read_hcup(where=[('I10_DX1', 'in', codes)],
+                       **dict(paths, **kwargs))
+    pd.testing.assert_frame_equal(
+        result, _recategorize(full[full['I10_DX1'].isin(codes)]))
+    with pytest.raises(ValueError):
+        read_hcup(where=[('AGE', '~', 1)], **hcup_paths('NIS_2015_Core'))
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_read_hcup_columns(engine):
+    paths = hcup_paths('NIS_2015Q1Q3_DX_PR_GRPS')
+    full = read_hcup(**paths)
+    result = read_hcup(columns=['KEY_NIS', 'PRn', 'DXCCS1[0-9]'],
+                       engine=engine, **paths)
+    expected = ['KEY_NIS'] + ['PR{}'.format(i) for i in range(1, 16)] \
+        + ['DXCCS1{}'.format(i) for i in range(10)]
+    assert sorted(result.columns) == sorted(expected)
+    pd.testing.assert_frame_equal(result, full[result.columns])
+    with pytest.raises(KeyError):
+        read_hcup(columns=['NOT_A_FIELD'], engine=engine, **paths)
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_read_hcup_n_jobs(engine):
+    paths = hcup_paths('NIS_2015_Core')
+    expected = read_hcup(chunksize=7, engine=engine, **paths)
+    result = read_hcup(chunksize=7, engine=engine, n_jobs=2, **paths)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_get_layout(layout_cache):
+    sas_script = hcup_paths('NIS_2015_Core')['sas_script']
+    sas_fwf._layouts.clear()
+    layout = get_layout(sas_script)
+    assert layout.lrecl == 86
+    assert layout.names[:2] == ['AGE', 'AGE_NEONATE']
+    assert layout.informats[:2] == ['N3PF', 'N2PF']
+    assert layout.widths[:2] == [3, 2]
+    assert layout.labels[0] == 'Age in years at admission'
+    assert layout.na_codes['N3PF'] == {'-99': '.', '-88': '.A', '-66': '.C'}
+    # served from memory, then from disk once memory is cleared
+    assert get_layout(sas_script) is layout
+    assert layout_cache.join('sas_layouts', layout.digest + '.json').check()
+    sas_fwf._layouts.clear()
+    cached = get_layout(sas_script)
+    assert cached is not layout and cached == layout
+    # read_hcup accepts the layout in place of the script
+    pd.testing.assert_frame_equal(
+        read_hcup(hcup_paths('NIS_2015_Core')['data_file'], layout),
+        read_hcup(**hcup_paths('NIS_2015_Core')))
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_read_hcup_per_column_na(tmpdir, engine):
+    paths = hcup_paths('NIS_2015_Core')
+    with open(paths['data_file']) as f:
+        records = f.readlines()
+    # AGE is N3PF (-99 = ., -88 = .A) and DIED is N2PF (-9 = ., -5 = .N)
+    records[0] = '-88' + records[0][3:9] + '-5' + records[0][11:]
+    records[1] = ' -9' + records[1][3:9] + '-9' + records[1][11:]
+    data_file = tmpdir.join('core.fwf')
+    data_file.write(''.join(records))
+    dat = read_hcup(str(data_file), paths['sas_script'], engine=engine,
+                    columns=['AGE', 'DIED'], missing_reasons=True)
+    assert list(dat.columns) == ['AGE', 'AGE_reason', 'DIED', 'DIED_reason']
+    assert dat['AGE_reason'].dtype == 'int8'
+    assert pd.isnull(dat.loc[0, 'AGE']) and dat.loc[0, 'AGE_reason'] == 1
+    assert pd.isnull(dat.loc[0, 'DIED']) and dat.loc[0, 'DIED_reason'] == 14
+    # -9 is only a missing code for N2PF fields, not for N3PF ones
+    assert dat.loc[1, 'AGE'] == '-9' and dat.loc[1, 'AGE_reason'] == 0
+    assert pd.isnull(dat.loc[1, 'DIED']) and dat.loc[1, 'DIED_reason'] == 0
+    assert (dat.loc[2:, ['AGE_reason', 'DIED_reason']] == 0).all().all()
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'numpy'])
+def test_read_hcup_compact_dtypes(engine):
+    paths = hcup_paths('NIS_2015_Core')
+    dat = read_hcup(compact_dtypes=True, engine=engine, **paths)
+    assert dat['AGE'].dtype == 'Int16'
+    assert dat['DIED'].dtype == 'Int8'
+    assert dat['LOS'].dtype == 'Int32'
+    assert dat['KEY_NIS'].dtype == 'Int64'
+    assert dat['DISCWT'].dtype == 'float64'
+    # same values as reading every numeric field as float64
+    meta = read_hcup(return_meta=True, **paths)
+    floats = pd.read_fwf(paths['data_file'], header=None, names=meta['names'],
+                         widths=meta['widths'], dtype=meta['dtypes'],
+                         na_values=meta['na_values'])
+    pd.testing.assert_frame_equal(dat.astype(float), floats)
+    report = compare_memory(floats, dat)
+    assert report.loc['DIED', 'ratio'] >= 4
+    assert report.loc['total', 'bytes_saved'] > 0
+
+
+@pytest.mark.parametrize('format', ['parquet', 'feather'])
+def test_convert(tmpdir, format):
+    pytest.importorskip('pyarrow')
+    paths = hcup_paths('NIS_2015_Core')
+    output = str(tmpdir.join('core'))
+    convert_main([paths['data_file'], paths['sas_script'], output,
+                  '--format', format, '--partition-cols', 'DQTR',
+                  '--chunksize', '20', '--engine', 'numpy',
+                  '--compact-dtypes'])
+    assert sorted(os.listdir(output)) == ['DQTR=1', 'DQTR=2', 'DQTR=3',
+                                          'DQTR=4']
+    expected = read_hcup(compact_dtypes=True, **paths)
+    result = read_converted(output, format=format)
+    result = result.sort_values('KEY_NIS').reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_categorical=False)
+    # filters on the partition column only read that partition
+    result = read_converted(output, format=format, columns=['KEY_NIS', 'DQTR'],
+                            filters=[('DQTR', '==', 1)])
+    assert (result['DQTR'] == 1).all()
+    assert len(result) == (expected['DQTR'] == 1).sum()
+    assert read_converted(output, format=format, return_meta=True) == \
+        get_layout(paths['sas_script'])
+
+
+def test_iter_hcup(tmpdir):
+    paths = hcup_paths('NIS_2015_Core')
+    # give one record a missing AGE, so the filter below is partly missing
+    layout = get_layout(paths['sas_script'])
+    i = layout.names.index('AGE')
+    start, width = layout.starts[i] - 1, layout.widths[i]
+    with open(paths['data_file'], 'rb') as f:
+        lines = f.read().split(b'\n')
+    lines[3] = lines[3][:start] + b'-99'.rjust(width) + \
+        lines[3][start + width:]
+    paths['data_file'] = str(tmpdir.join('NIS_2015_Core.fwf'))
+    with open(paths['data_file'], 'wb') as f:
+        f.write(b'\n'.join(lines))
+    full = read_hcup(compact_dtypes=True, **paths)
+    assert full['AGE'].isnull().sum() == 1
+    old = full[(full['AGE'] >= 65).fillna(False)]
+    chunks = list(iter_hcup(transforms=[lambda d: d['AGE'] >= 65,
+                                        lambda d: d.assign(W=d['LOS'] / 7)],
+                            chunksize=7, **paths))
+    assert all(len(x) <= 7 for x in chunks)
+    result = pd.concat(chunks)
+    pd.testing.assert_frame_equal(result.drop(columns='W'), old)
+    pd.testing.assert_series_equal(result['W'], old['LOS'] / 7,
+                                   check_names=False)
+    # streaming means agree with the in-memory ones
+    totals = iter_hcup(reduce=group_totals('DQTR', ['DIED', 'LOS']),
+                       chunksize=7, **paths)
+    means = full.groupby('DQTR')[['DIED', 'LOS']].mean()
+    pd.testing.assert_frame_equal(totals['sum'] / totals['count'],
+                                  means.astype(float), check_dtype=False)
+
+
+def test_betabinom_pmf_log():
+    rng = np.random.RandomState(0)
+    n = rng.randint(0, 2000, size=500)
+    k = rng.binomial(n, rng.beta(2, 5, size=500))
+    endog = pd.DataFrame({'k': k, 'n': n})
+    model = betabinom(endog=endog)
+    expected = scipy.stats.betabinom.logpmf(k, n, 2.5, 4.)
+    np.testing.assert_allclose(model.pmf_log(model.endog, 2.5, 4.), expected)
+    np.testing.assert_allclose(model.pmf_log(endog, 2.5, 4.), expected)
+
+
+def test_betabinom_derivatives():
+    from statsmodels.tools.numdiff import approx_fprime, approx_hess
+    rng = np.random.RandomState(1)
+    n = rng.randint(1, 300, size=2000)
+    k = rng.binomial(n, rng.beta(2, 5, size=2000))
+    model = betabinom(endog=np.column_stack([k, n]))
+    params = np.array([1.7, 4.2])
+    np.testing.assert_allclose(model.score(params),
+                               approx_fprime(params, model.loglike, centered=True),
+                               rtol=1e-5)
+    np.testing.assert_allclose(model.hessian(params),
+                               approx_hess(params, model.loglike), rtol=1e-5)
+    assert model.score_obs(params).shape == (2000, 2)
+    res = model.fit(disp=0)
+    assert res.mle_retvals['converged']
+    np.testing.assert_allclose(model.score(res.params), 0, atol=1e-3)
+
+
+def test_betabinom_overdispersed():
+    # a, b < 1, where an unconstrained line search steps to a, b <= 0
+    rng = np.random.RandomState(4)
+    n = rng.randint(1, 300, size=2000)
+    k = rng.binomial(n, rng.beta(0.05, 0.1, size=2000))
+    model = betabinom(endog=np.column_stack([k, n]))
+    res = model.fit(disp=0)
+    assert res.mle_retvals['converged']
+    assert res.mle_retvals['iterations'] > 0
+    expected = model.fit(method='newton', disp=0).params
+    np.testing.assert_allclose(res.params, expected, rtol=1e-4)
+    assert (res.params < 1).all()
+    np.testing.assert_allclose(model.score(res.params), 0, atol=1e-3)
+
+
+def test_betabinom_unique_pairs():
+    # many small groups only have a handful of distinct (k, n) pairs
+    rng = np.random.RandomState(2)
+    n = rng.randint(1, 6, size=10000)
+    k = rng.binomial(n, 0.1)
+    model = betabinom(endog=np.column_stack([k, n]))
+    assert len(model._freq) <= 20 and model._freq.sum() == 10000
+    expected = scipy.stats.betabinom.logpmf(k, n, 0.5, 4.)
+    np.testing.assert_allclose(model.loglike([0.5, 4.]), expected.sum())
+    np.testing.assert_allclose(model.loglikeobs([0.5, 4.]), expected)
+    assert model.score_obs([0.5, 4.]).shape == (10000, 2)
+
+
+def test_betabinom_start_params():
+    # rare outcome, far from the old fixed start of (2, 2)
+    rng = np.random.RandomState(3)
+    n = rng.randint(1, 500, size=5000)
+    k = rng.binomial(n, rng.beta(0.5, 25, size=5000))
+    model = betabinom(endog=np.column_stack([k, n]))
+    res = model.fit(disp=0)
+    assert res.mle_retvals['converged']
+    np.testing.assert_allclose(model.start_params_moments(), res.params,
+                               rtol=0.1)
+    assert 0 < res.mle_retvals['iterations'] < 20
+    # refits under the same key start from the cached solution
+    key = ('DIED', 'HOSP_NIS')
+    first = model.fit(cache_key=key, disp=0)
+    np.testing.assert_array_equal(betabinom_mod._warm_starts[key],
+                                  first.params)
+    refit = betabinom(endog=np.column_stack([k, n])).fit(cache_key=key, disp=0)
+    assert refit.mle_retvals['iterations'] == 0
+
+
+def test_fit_many():
+    rng = np.random.RandomState(4)
+    endogs = {}
+    for i, (a, b) in enumerate([(2, 5), (0.5, 25), (0.3, 0.2), (20, 60)]):
+        n = rng.randint(1, 200, size=300)
+        endogs['outcome{}'.format(i)] = pd.DataFrame(
+            {'k': rng.binomial(n, rng.beta(a, b, size=300)), 'n': n})
+    result = fit_many(endogs)
+    assert list(result.index) == list(endogs) and result['converged'].all()
+    for key, endog in endogs.items():
+        res = betabinom(endog=endog).fit(disp=0)
+        np.testing.assert_allclose(result.loc[key, ['a', 'b']], res.params,
+                                   rtol=1e-3)
+        assert result.loc[key, 'llf'] >= res.llf - 1e-6
+    pd.testing.assert_frame_equal(
+        fit_many(endogs, n_jobs=2, batch_size=3), result)
+    assert not result['boundary'].any()
+
+
+def test_fit_many_degenerate():
+    rng = np.random.RandomState(9)
+    n = rng.randint(1, 50, size=300)
+    endogs = [np.column_stack([np.zeros(10), np.full(10, 5)]),
+              np.column_stack([np.full(10, 5), np.full(10, 5)]),
+              # rare events and no overdispersion: a, b run off to infinity
+              np.column_stack([rng.binomial(n, 0.002), n]),
+              np.column_stack([rng.binomial(n, 0.3), n])]
+    result = fit_many(endogs)
+    assert (result['llf'] <= 0).all()
+    assert list(result['boundary']) == [True, True, False, False]
+    assert not result['converged'][:2].any() and result['converged'][2:].all()
+    assert result['a'][0] == 0 == result['b'][1]
+    np.testing.assert_allclose(result['llf'][:2], 0)
+    for i in [2, 3]:
+        res = betabinom(endog=endogs[i]).fit(disp=0)
+        assert result['llf'][i] >= res.llf - 1e-6
+
+
+def test_shrink_counts():
+    rng = np.random.RandomState(5)
+    dat = pd.DataFrame({'values': rng.binomial(1, 0.2, 3000),
+                        'index': rng.choice(list('abcdefgh'), 3000),
+                        'columns': rng.choice(list('PQRSTU'), 3000)})
+    grouped = dat.groupby(['index', 'columns'])['values']
+    expected = grouped.agg(lambda x: shrink(x, a=2., b=7.))
+    result = shrink_counts(grouped.sum(), grouped.count(), a=2., b=7.)
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+    ax = aov_xtab(dat['values'], dat['index'], dat['columns'], disp=0)
+    assert ax.collections[0].get_array().shape == (8, 6)
+    plt.close('all')
+
+
+def test_cross_tab_stats():
+    rng = np.random.RandomState(6)
+    dat = pd.DataFrame({'values': rng.binomial(1, 0.2, 3000).astype(float),
+                        'index': rng.choice(list('abcdefgh'), 3000),
+                        'columns': rng.choice(list('PQRSTU'), 3000)})
+    dat.loc[::17, 'values'] = np.nan
+    dat.loc[::23, 'index'] = None
+    stats = CrossTabStats(dat['values'], dat['index'], dat['columns'])
+    grouped = dat.groupby(['index', 'columns'])['values']
+    expected = pd.DataFrame({'k': grouped.sum(), 'n': grouped.count()})
+    pd.testing.assert_frame_equal(stats.endog, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(
+        stats.counts, pd.crosstab(dat['index'], dat['columns']),
+        check_dtype=False)
+    # categorical keys with unused and unsorted categories
+    cats = CrossTabStats(
+        dat['values'],
+        dat['index'].astype(pd.CategoricalDtype(list('zhgfedcba'))),
+        dat['columns'].astype('category'))
+    pd.testing.assert_frame_equal(cats.endog, stats.endog, check_dtype=False,
+                                  check_index_type=False)
+    pd.testing.assert_frame_equal(cats.counts, stats.counts,
+                                  check_index_type=False,
+                                  check_column_type=False)
+    # ordered categoricals keep their order
+    levels = pd.CategoricalDtype(['lo', 'mid', 'hi'], ordered=True)
+    ordered = CrossTabStats(dat['values'], dat['columns'].map(
+        dict(zip('PQRSTU', ['lo', 'mid', 'hi'] * 2))).astype(levels))
+    assert list(ordered.index) == ['lo', 'mid', 'hi']
+    with pytest.raises(ValueError):
+        stats.shrunk
+    stats.fit(disp=0)
+    pd.testing.assert_series_equal(
+        stats.shrunk.stack(),
+        shrink_counts(expected['k'], expected['n'], stats.a, stats.b),
+        check_names=False)
+    # one grouping factor
+    stats = CrossTabStats(dat['values'], dat['columns'])
+    grouped = dat.groupby('columns')['values']
+    pd.testing.assert_series_equal(stats.endog['n'], grouped.count(),
+                                   check_names=False, check_dtype=False)
+    ax = shrink_1d(dat['values'], dat['columns'], disp=0)
+    assert len(ax.patches) == 6
+    plt.close('all')
+
+
+def test_aov_xtab_data():
+    rng = np.random.RandomState(7)
+    dat = pd.DataFrame({'values': rng.binomial(1, 0.2, 5000),
+                        'index': rng.randint(30, size=5000),
+                        'columns': rng.choice(list('PQRSTUVWXYZ'), 5000)})
+    result = aov_xtab(dat['values'], dat['index'], dat['columns'],
+                      plot=False, disp=0)
+    shrunk, counts = result['shrunk'], result['counts']
+    assert shrunk.shape == counts.shape == (30, 11)
+    assert shrunk.mean(axis=1).is_monotonic_decreasing
+    assert shrunk.mean(axis=0).is_monotonic_decreasing
+    assert counts.values.sum() == 5000
+    assert list(result['sd'].index) == ['rows', 'columns', 'interaction']
+    # the least frequent levels are pooled for plotting
+    stats = CrossTabStats(dat['values'], dat['index'], dat['columns'])
+    top = stats.top(max_index=5, max_columns=4)
+    assert top.counts.shape == (5, 4) and top.counts.values.sum() == 5000
+    assert top.index[-1] == top.columns[-1] == '(other)'
+    ax = aov_xtab(dat['values'], dat['index'], dat['columns'], max_levels=5,
+                  disp=0)
+    assert ax.collections[0].get_array().shape == (5, 5)
+    plt.close('all')
+
+
+@pytest.mark.parametrize('compact_dtypes', [False, True])
+def test_summarize_df(compact_dtypes):
+    df = read_hcup(compact_dtypes=compact_dtypes, **hcup_paths('NIS_2015_Core'))
+    df['TEXT'] = df['HOSP_DIVISION'].astype(object)
+    # integer columns whose range doesn't fit in int64
+    big = np.arange(len(df)) % 5
+    df['UINT64'] = big.astype(np.uint64) * np.uint64(2**62 - 1)
+    df['UINT64_NARROW'] = big.astype(np.uint64) + np.uint64(2**63)
+    df['WIDE'] = np.where(big < 2, np.iinfo(np.int64).min,
+                          np.iinfo(np.int64).max - big)
+    for dropna in [False, True]:
+        expected = pd.DataFrame([df.dtypes, df.nunique(dropna=dropna),
+                                 df.isnull().mean(axis=0)],
+                                index=['dtype', 'nunique', '%missing'])
+        result = summarize_df(df, dropna=dropna, n_jobs=2)
+        pd.testing.assert_frame_equal(result.iloc[:3], expected,
+                                      check_index_type=False)
+    # approximations for long frames
+    rng = np.random.RandomState(8)
+    ids = pd.Series(rng.randint(10**9, size=300000).astype(str), dtype=object)
+    ids[::10] = None
+    df = pd.DataFrame({'ID': ids, 'X': rng.randint(100, size=300000)})
+    result = summarize_df(df, approx=True, sample_size=20000)
+    for col in df.columns:
+        assert abs(result.loc['nunique', col] - df[col].nunique(dropna=False)) \
+            <= 3 * result.loc['nunique_se', col] + 1e-9
+        assert abs(result.loc['%missing', col] - df[col].isnull().mean()) \
+            <= 3 * result.loc['%missing_se', col] + 1e-9
+    assert result.loc['nunique_se', 'ID'] > 0 == result.loc['nunique_se', 'X']
+
+
+def test_summarize_df_chunks():
+    paths = hcup_paths('NIS_2015_Core')
+    expected = summarize_df(read_hcup(compact_dtypes=True, **paths),
+                            approx=True)
+    chunks = list(read_hcup(chunksize=7, combine_chunks=False,
+                            compact_dtypes=True, **paths))
+    result = summarize_df(iter(chunks))
+    pd.testing.assert_frame_equal(result.drop(['dtype', 'nunique_se']),
+                                  expected.drop(['dtype', 'nunique_se']),
+                                  check_dtype=False, check_index_type=False)
+    # states of separate runs merge into the state of the whole file
+    first, second = SummaryState(), SummaryState()
+    for chunk in chunks[:3]:
+        first.update(chunk)
+    for chunk in chunks[3:]:
+        second.update(chunk)
+    pd.testing.assert_frame_equal(first.merge(second).summary(), result)
+
+
+def test_align_frames():
+    q1q3 = read_hcup(**hcup_paths('NIS_2015Q1Q3_DX_PR_GRPS'))
+    q4 = read_hcup(**hcup_paths('NIS_2015Q4_DX_PR_GRPS'))
+    q4['KEY_NIS'] = q4['KEY_NIS'].astype(object)
+    before = q4.copy()
+    frames = [q1q3, q4, q1q3.iloc[:5]]
+    aligned = align_frames(*frames)
+    pd.testing.assert_frame_equal(q4, before)
+    columns = list(q1q3.columns) + [x for x in q4.columns
+                                    if x not in q1q3.columns]
+    for frame, result in zip(frames, aligned):
+        assert list(result.columns) == columns
+        assert (result.index == frame.index).all()
+        for col in frame.columns:
+            pd.testing.assert_series_equal(result[col].astype(object),
+                                           frame[col].astype(object))
+    stacked = pd.concat(aligned)
+    for col in columns:
+        if any(isinstance(f[col].dtype, pd.CategoricalDtype)
+               for f in frames if col in f.columns):
+            assert isinstance(stacked[col].dtype, pd.CategoricalDtype)
+            assert stacked[col].cat.categories.is_monotonic_increasing
+    # float64 is only downcast when nothing is lost
+    a = pd.DataFrame({'x': [1.5, np.nan], 'y': [0.1, 1.]})
+    b = pd.DataFrame({'x': [2.25, 3.]})
+    a2, b2 = align_cols(a, b)
+    assert a2['x'].dtype == b2['x'].dtype == np.float32
+    assert a2['y'].dtype == b2['y'].dtype == np.float64
+    assert b2['y'].isnull().all()
+
+
+@pytest.mark.parametrize('kind', ['DX_PR_GRPS', 'Severity'])
+def test_read_hcup_many(tmpdir, kind):
+    paths = [hcup_paths('NIS_2015{}_{}'.format(q, kind))
+             for q in ('Q1Q3', 'Q4')]
+    specs = [(x['data_file'], x['sas_script']) for x in paths]
+    chunks = list(read_hcup_many(specs, chunksize=7))
+    assert all(len(x) <= 7 for x in chunks)
+    # every chunk has the same columns, and dtypes up to the categories
+    for chunk in chunks:
+        assert list(chunk.columns) == list(chunks[0].columns)
+        assert [str(x) for x in chunk.dtypes
+                if not isinstance(x, pd.CategoricalDtype)] == \
+            [str(x) for x in chunks[0].dtypes
+             if not isinstance(x, pd.CategoricalDtype)]
+    result = sas_fwf.stack_chunks(chunks)
+    frames = [read_hcup(compact_dtypes=True, **x) for x in paths]
+    expected = pd.concat(align_frames(*frames, downcast=False),
+                         ignore_index=True)
+    # missing columns keep their file's dtype (e.g. Int16), not float
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    for col in frames[0].columns:
+        if not isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            assert result[col].dtype == frames[0][col].dtype
+    # per-file arguments override the shared ones
+    specs[1] = dict(paths[1], columns=['KEY_NIS'])
+    result = sas_fwf.stack_chunks(list(read_hcup_many(specs)))
+    assert list(result.columns) == list(frames[0].columns)
+    pytest.importorskip('pyarrow')
+    output = str(tmpdir.join('many'))
+    read_hcup_many(specs, output=output, chunksize=20)
+    pd.testing.assert_frame_equal(read_converted(output), result,
+                                  check_categorical=False)
+    assert read_converted(output, return_meta=True) == \
+        [get_layout(x['sas_script']) for x in paths]